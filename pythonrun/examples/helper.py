@@ -3,9 +3,22 @@
 """辅助模块，用于测试递归导入"""
 
 import pandas as pd
+# 只保存图片文件，使用非交互式后端，避免加载GUI库
+import matplotlib
+matplotlib.use('Agg')
 import seaborn as sns
 import matplotlib.pyplot as plt
 
+# numba是可选依赖，数据量较大时用于加速分组统计
+try:
+    import numba  # noqa: F401
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+# 使用numba引擎的最小行数，数据量较小时JIT编译开销大于收益
+NUMBA_MIN_ROWS = 10000
+
 def plot_data(data, title="数据可视化"):
     """绘制数据图表
     
@@ -40,14 +53,27 @@ def analyze_data(data):
     返回:
         统计结果的字典
     """
-    # 分组计算统计量
-    grouped = data.groupby('category')
-    stats = {
-        'count': grouped.count()['x'].to_dict(),
-        'mean_x': grouped.mean()['x'].to_dict(),
-        'mean_y': grouped.mean()['y'].to_dict(),
-        'std_x': grouped.std()['x'].to_dict(),
-        'std_y': grouped.std()['y'].to_dict(),
-    }
+    if HAS_NUMBA and len(data) >= NUMBA_MIN_ROWS:
+        # 大数据量时使用numba编译的分组内核
+        grouped = data.groupby('category')[['x', 'y']]
+        means = grouped.mean(engine='numba')
+        stds = grouped.std(engine='numba')
+        return {
+            'count': grouped['x'].count().to_dict(),
+            'mean_x': means['x'].to_dict(),
+            'mean_y': means['y'].to_dict(),
+            'std_x': stds['x'].to_dict(),
+            'std_y': stds['y'].to_dict(),
+        }
+    
+    # 一次分组同时计算所有统计量
+    agg = data.groupby('category').agg(
+        count=('x', 'count'),
+        mean_x=('x', 'mean'),
+        mean_y=('y', 'mean'),
+        std_x=('x', 'std'),
+        std_y=('y', 'std'),
+    )
+    stats = {name: agg[name].to_dict() for name in agg.columns}
     
     return stats 
\ No newline at end of file
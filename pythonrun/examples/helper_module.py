@@ -6,24 +6,37 @@ pythonrun示例：辅助模块，提供数据处理和可视化功能
 
 import os
 import numpy as np
+# 只保存图片文件，使用非交互式后端，避免加载GUI库
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import seaborn as sns
 from pathlib import Path
 
 def process_data(df):
     """处理数据，计算相关性并添加随机噪声"""
+    # 直接在numpy数组上计算，避免Series运算的索引对齐
+    x = df['x'].to_numpy()
+    y = df['y'].to_numpy()
+    
     # 添加相关性噪声
-    df['z'] = df['x'] * 0.5 + df['y'] * 0.3 + np.random.normal(0, 1, len(df))
+    df['z'] = x * 0.5 + y * 0.3 + np.random.normal(0, 1, len(df))
     
     # 计算相关系数
-    df['correlation'] = df['x'].corr(df['y'])
+    df['correlation'] = float(np.corrcoef(x, y)[0, 1])
     
     return df
 
 def visualize_data(df, output_file='plot.png'):
     """可视化数据"""
-    # 设置样式
-    sns.set_theme(style="whitegrid")
+    # 设置白色网格样式，只有一张图，直接更新rcParams
+    plt.rcParams.update({
+        'axes.facecolor': 'white',
+        'axes.edgecolor': '.8',
+        'axes.grid': True,
+        'axes.axisbelow': True,
+        'grid.color': '.8',
+    })
     
     # 创建图表
     plt.figure(figsize=(10, 8))
@@ -3,6 +3,9 @@
 """测试pythonrun自动安装功能的示例脚本"""
 
 import numpy as np
+# 只保存图片文件，使用非交互式后端，避免加载GUI库
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 
 def main():
@@ -8,29 +8,27 @@ from helper import plot_data, analyze_data
 
 def main():
     """主函数"""
-    # 设置随机种子以便结果可复现
-    np.random.seed(42)
+    # 使用固定种子的随机数生成器以便结果可复现
+    rng = np.random.default_rng(42)
     
     # 创建示例数据
     n_samples = 300
     
     # 创建三类数据
     categories = ['A', 'B', 'C']
-    data = []
+    per_category = n_samples // 3
     
-    # 为每个类别生成不同的数据分布
-    for i, category in enumerate(categories):
-        x = np.random.normal(i * 3, 1.0, n_samples // 3)
-        y = np.random.normal(i * 2, 1.5, n_samples // 3)
-        for j in range(len(x)):
-            data.append({
-                'x': x[j], 
-                'y': y[j],
-                'category': category
-            })
+    # 每个类别的 (x, y) 均值和标准差，一次调用生成所有类别的数据
+    locs = np.array([[i * 3, i * 2] for i in range(len(categories))], dtype=float)
+    xy = rng.normal(loc=locs[:, None, :], scale=[1.0, 1.5],
+                    size=(len(categories), per_category, 2))
     
-    # 转换为DataFrame
-    df = pd.DataFrame(data)
+    # 按列构造DataFrame
+    df = pd.DataFrame({
+        'x': xy[:, :, 0].ravel(),
+        'y': xy[:, :, 1].ravel(),
+        'category': np.repeat(categories, per_category)
+    })
     
     # 使用helper模块的函数绘制数据
     plot_data(df, title="多类别数据的散点图")
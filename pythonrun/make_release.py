@@ -5,9 +5,14 @@
 import os
 import sys
 import re
+import shutil
 import subprocess
 from pathlib import Path
 import argparse
+import importlib.util
+
+# __init__.py中的版本号定义
+_VERSION_RE = re.compile(r'__version__\s*=\s*["\']([^"\']+)["\']')
 
 def update_version(release_type='patch'):
     """更新版本号
@@ -21,7 +26,7 @@ def update_version(release_type='patch'):
     # 读取当前版本
     with open("pythonrun/pythonrun/__init__.py", "r", encoding="utf-8") as f:
         content = f.read()
-        version_match = re.search(r'__version__ = "(.*?)"', content)
+        version_match = _VERSION_RE.search(content)
         current_version = version_match.group(1)
     
     # 解析版本号
@@ -42,7 +47,7 @@ def update_version(release_type='patch'):
     
     # 写回新版本号
     with open("pythonrun/pythonrun/__init__.py", "w", encoding="utf-8") as f:
-        f.write(content.replace(current_version, new_version))
+        f.write(_VERSION_RE.sub(f'__version__ = "{new_version}"', content, count=1))
     
     print(f"版本从 {current_version} 更新到 {new_version}")
     return new_version
@@ -59,15 +64,34 @@ def clean_build_files():
     for dir_name in dirs_to_remove:
         try:
             if os.path.exists(dir_name):
-                subprocess.run(["rm", "-rf", dir_name], check=True)
+                shutil.rmtree(dir_name)
                 print(f"已删除 {dir_name}")
         except Exception as e:
             print(f"删除 {dir_name} 时出错: {e}")
 
-def build_package():
-    """构建包"""
+# 关闭构建隔离时，当前环境中需要具备的构建工具
+BUILD_REQUIREMENTS = ["build", "setuptools", "wheel"]
+
+def ensure_build_tools():
+    """确保当前环境中安装了构建工具，缺少时一次性安装"""
+    missing = [name for name in BUILD_REQUIREMENTS if importlib.util.find_spec(name) is None]
+    if missing:
+        print(f"安装构建工具: {', '.join(missing)}")
+        subprocess.run([sys.executable, "-m", "pip", "install"] + missing, check=True)
+
+def build_package(fresh=False):
+    """构建包
+    
+    参数:
+        fresh: 如果为True，使用隔离的全新构建环境，否则直接使用当前环境中的构建工具
+    """
     try:
-        subprocess.run([sys.executable, "-m", "build"], check=True)
+        cmd = [sys.executable, "-m", "build", "--wheel", "--sdist"]
+        if not fresh:
+            # 复用当前环境，避免每次构建都重新创建虚拟环境并下载构建后端
+            ensure_build_tools()
+            cmd.append("--no-isolation")
+        subprocess.run(cmd, check=True)
         print("构建成功")
         return True
     except Exception as e:
@@ -103,6 +127,7 @@ def main():
     parser.add_argument('--production', action='store_true', help='发布到生产PyPI而不是TestPyPI')
     parser.add_argument('--release-type', choices=['major', 'minor', 'patch'], 
                         default='patch', help='版本升级类型')
+    parser.add_argument('--fresh', action='store_true', help='在隔离的全新环境中构建，保证可复现')
     args = parser.parse_args()
     
     # 更新版本
@@ -112,7 +137,7 @@ def main():
     clean_build_files()
     
     # 构建包
-    if not build_package():
+    if not build_package(args.fresh):
         return 1
     
     # 发布到PyPI
@@ -4,7 +4,9 @@
 pythonrun CLI 入口
 """
 
+import sys
+
 from .main import main
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    sys.exit(main()) 
\ No newline at end of file
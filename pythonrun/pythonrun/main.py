@@ -36,8 +36,8 @@ def main():
         print(f"文件不存在: {file_path}")
         return
     
-    # 处理文件
-    process_file(file_path)
+    # 处理文件，以脚本的返回码退出
+    return process_file(file_path)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    sys.exit(main()) 
\ No newline at end of file
@@ -2,75 +2,279 @@
 
 import os
 import sys
+import ast
+import json
+import hashlib
+import collections
 import tempfile
 import logging
 import subprocess
+import concurrent.futures
 from typing import Set, Tuple, Dict, Any, List, Optional
-import importlib.util
 
 from .utils.package_manager import (
-    get_package_for_module, install_package, is_module_installed,
-    check_and_install_requirements
+    get_package_for_module, install_packages, is_module_installed,
+    check_and_install_requirements, refresh_local_search_paths
 )
 from .utils.code_analyzer import (
-    parse_imports, find_local_imports, modify_code_to_autoinstall
+    parse_imports, find_local_modules, modify_code_to_autoinstall,
+    parse_source, may_contain_imports
 )
-from .utils.config import load_config
+from .utils.config import load_config, CONFIG_DIR
 
 logger = logging.getLogger('pythonrun')
 
-def process_recursive_imports(file_path: str, processed_files: Set[str] = None) -> Set[Tuple[str, str]]:
-    """递归处理Python文件的导入，返回所有需要安装的包
+# 已解析文件的缓存: {文件路径: ((修改时间, 文件大小), 语法树, 导入列表, 本地导入列表)}
+_PARSE_CACHE: Dict[str, Tuple[Tuple[int, int], Optional[ast.Module], list, list]] = {}
+
+# 并行读取文件时的线程数，按CPU数量设置，最多8个避免磁盘争用
+_READ_WORKERS = min(8, (os.cpu_count() or 1) + 2)
+
+def _read_source(file_path: str) -> Tuple[Tuple[int, int], Optional[bytes]]:
+    """读取Python文件内容，只做I/O，可以在线程池中执行
     
     参数:
-        file_path: 要处理的Python文件路径
-        processed_files: 已处理的文件集合，避免循环导入
+        file_path: Python文件路径
         
     返回:
-        需要安装的包集合 (模块名, 包名)
+        ((修改时间, 文件大小), 文件字节)，解析缓存仍然有效时文件字节为None
     """
-    if processed_files is None:
-        processed_files = set()
+    st = os.stat(file_path)
+    key = (st.st_mtime_ns, st.st_size)
+    
+    cached = _PARSE_CACHE.get(file_path)
+    if cached is not None and cached[0] == key:
+        return key, None
     
-    # 防止重复处理
-    if file_path in processed_files:
-        return set()
+    # 直接读取字节，由编译器按编码声明解码，不在Python层生成完整的字符串
+    with open(file_path, 'rb') as f:
+        return key, f.read()
+
+def _get_parsed(file_path: str, pending: Optional[concurrent.futures.Future] = None
+                ) -> Optional[Tuple[Optional[ast.Module], list, list]]:
+    """读取并解析Python文件，结果按 (修改时间, 文件大小) 缓存
     
-    processed_files.add(file_path)
+    同一个文件可能通过多条导入路径被访问到，缓存避免重复读取和解析
     
-    # 读取文件内容
+    参数:
+        file_path: Python文件路径
+        pending: 已提交到线程池的 _read_source 任务，为None时直接读取
+        
+    返回:
+        (语法树, 导入列表, 本地导入列表)，读取失败时返回None
+    """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            code = f.read()
+        key, source = pending.result() if pending is not None else _read_source(file_path)
     except Exception as e:
         logger.error(f"读取文件 {file_path} 失败: {e}")
-        return set()
+        return None
     
-    # 解析导入
-    imports = parse_imports(code)
-    packages_to_install = set()
+    if source is None:
+        return _PARSE_CACHE[file_path][1:]
     
-    # 处理每个导入
-    for module_name, _ in imports:
-        # 获取要安装的包名
-        package_name = get_package_for_module(module_name, file_path)
+    cached_imports = _load_import_cache(file_path, key) if may_contain_imports(source) else ([], [])
+    if cached_imports is not None:
+        # 没有import关键字的文件或磁盘缓存仍然有效的文件不需要解析，
+        # 本地模块的位置可能已经变化，每次重新查找
+        tree = None
+        imports, all_imports = cached_imports
+        local_imports = find_local_modules(all_imports, file_path) if all_imports else []
+    else:
+        try:
+            tree = parse_source(source, file_path)
+        except (SyntaxError, ValueError) as e:
+            logger.error(f"解析代码时遇到语法错误: {e}")
+            tree, imports, local_imports = None, [], []
+        else:
+            # 可选依赖不需要安装，本地模块仍然全部遍历
+            imports = parse_imports(tree, include_optional=False)
+            all_imports = parse_imports(tree)
+            local_imports = find_local_modules(all_imports, file_path)
+            _save_import_cache(file_path, key, imports, all_imports)
+    
+    _PARSE_CACHE[file_path] = (key, tree, imports, local_imports)
+    return tree, imports, local_imports
+
+def _write_json_atomic(directory: str, path: str, data: Any) -> None:
+    """原子地写入JSON文件，先写入同目录下的临时文件再替换，失败时抛出OSError"""
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+# 单个文件导入列表的磁盘缓存目录，以及最多保留的缓存文件数
+_IMPORTS_CACHE_DIR = os.path.join(CONFIG_DIR, 'imports')
+_IMPORTS_CACHE_MAX_ENTRIES = 2000
+
+# 本进程是否已经检查过缓存目录的大小
+_IMPORTS_CACHE_PRUNED = False
+
+def _import_cache_path(file_path: str) -> str:
+    """文件对应的导入缓存路径，不同Python版本的语法不同，分别缓存"""
+    version = '.'.join(map(str, sys.version_info[:2]))
+    digest = hashlib.sha1(f"{version}\0{file_path}".encode('utf-8')).hexdigest()
+    return os.path.join(_IMPORTS_CACHE_DIR, f"{digest}.json")
+
+def _load_import_cache(file_path: str, key: Tuple[int, int]) -> Optional[Tuple[list, list]]:
+    """读取文件的导入缓存，仅当 (修改时间, 文件大小) 与记录一致时才返回
+    
+    返回:
+        (不含可选导入的导入列表, 所有导入列表)，缓存无效时返回None
+    """
+    try:
+        with open(_import_cache_path(file_path), 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        if tuple(cache['key']) != key:
+            return None
+        return ([tuple(item) for item in cache['imports']],
+                [tuple(item) for item in cache['all_imports']])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def _mtime_or_zero(entry: os.DirEntry) -> int:
+    """目录项的修改时间，文件已被删除时返回0"""
+    try:
+        return entry.stat().st_mtime_ns
+    except OSError:
+        return 0
+
+def _prune_import_cache() -> None:
+    """缓存文件超过上限时删除最早写入的条目，包括已删除或移动的源文件留下的条目"""
+    try:
+        with os.scandir(_IMPORTS_CACHE_DIR) as it:
+            entries = [entry for entry in it if entry.name.endswith('.json')]
+    except OSError:
+        return
+    
+    excess = len(entries) - _IMPORTS_CACHE_MAX_ENTRIES
+    if excess <= 0:
+        return
+    
+    entries.sort(key=_mtime_or_zero)
+    for entry in entries[:excess]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+def _save_import_cache(file_path: str, key: Tuple[int, int], imports: list, all_imports: list) -> None:
+    """写入文件的导入缓存，每个进程第一次写入时检查缓存目录的大小"""
+    global _IMPORTS_CACHE_PRUNED
+    try:
+        _write_json_atomic(_IMPORTS_CACHE_DIR, _import_cache_path(file_path),
+                           {'key': list(key), 'imports': imports, 'all_imports': all_imports})
+    except OSError as e:
+        logger.debug(f"写入导入缓存失败: {e}")
+        return
+    
+    if not _IMPORTS_CACHE_PRUNED:
+        _IMPORTS_CACHE_PRUNED = True
+        _prune_import_cache()
+
+def _normalize_path(file_path: str, cwd: str) -> str:
+    """将路径规范化为绝对路径，使用已知的工作目录避免每次调用getcwd
+    
+    返回的路径经过驻留，重复出现的同一路径是同一个对象，集合查找更快
+    """
+    if not os.path.isabs(file_path):
+        file_path = os.path.join(cwd, file_path)
+    return sys.intern(os.path.normpath(file_path))
+
+def _collect_candidates(file_path: str, processed_files: Set[str], cwd: str,
+                        executor: Optional[concurrent.futures.Executor] = None) -> Set[Tuple[str, str]]:
+    """遍历Python文件及其递归导入的本地模块，收集所有第三方包
+    
+    使用工作队列按广度优先顺序遍历本地模块，不会因导入层级过深而递归溢出。
+    提供线程池时，文件在入队时就开始读取，与主线程上的解析重叠进行
+    
+    参数:
+        file_path: 要处理的Python文件路径
+        processed_files: 已处理的文件集合，遍历过的文件会加入其中
+        cwd: 当前工作目录，用于规范化相对路径
+        executor: 用于预读文件的线程池，为None时按顺序读取
+        
+    返回:
+        候选包集合 (模块名, 包名)，不检查是否已安装
+    """
+    candidates = set()
+    queue = collections.deque()
+    
+    def enqueue(path: str) -> None:
+        # 规范化路径，同一个文件无论以何种形式引用都只入队一次
+        path = _normalize_path(path, cwd)
+        if path not in processed_files:
+            processed_files.add(path)
+            pending = executor.submit(_read_source, path) if executor is not None else None
+            queue.append((path, pending))
+    
+    enqueue(file_path)
+    while queue:
+        current_file, pending = queue.popleft()
+        
+        # 读取并解析文件（结果按修改时间缓存）
+        parsed = _get_parsed(current_file, pending)
+        if parsed is None:
+            continue
+        _, imports, local_imports = parsed
+        
+        # 获取每个导入要安装的包名
+        for module_name, _ in imports:
+            package_name = get_package_for_module(module_name, current_file)
+            if package_name:
+                candidates.add((module_name, package_name))
         
-        # 检查是否需要安装
-        if package_name and not is_module_installed(module_name):
-            packages_to_install.add((module_name, package_name))
+        # 未处理过的本地导入加入队列，稍后处理
+        for local_import in local_imports:
+            enqueue(local_import)
+    
+    return candidates
+
+def process_recursive_imports(file_path: str, processed_files: Set[str] = None,
+                              cwd: str = None, parallel: bool = False) -> Set[Tuple[str, str]]:
+    """处理Python文件及其递归导入的本地模块，返回所有需要安装的包
+    
+    未修改的文件的导入列表从磁盘缓存读取，本地模块每次重新查找，
+    因此新增或删除的本地模块都能被发现
+    
+    参数:
+        file_path: 要处理的Python文件路径
+        processed_files: 已处理的文件集合，避免循环导入
+        cwd: 当前工作目录，用于规范化相对路径
+        parallel: 是否在线程池中预读本地模块文件（对应配置项parallel_parse）
+        
+    返回:
+        需要安装的包集合 (模块名, 包名)
+    """
+    if cwd is None:
+        cwd = os.getcwd()
+    
+    if processed_files is None:
+        processed_files = set()
     
-    # 查找并处理本地导入
-    local_imports = find_local_imports(code, file_path)
-    for local_module in local_imports:
-        # 递归处理
-        sub_packages = process_recursive_imports(local_module, processed_files)
-        packages_to_install.update(sub_packages)
+    entry_file = _normalize_path(file_path, cwd)
+    if parallel:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=_READ_WORKERS) as executor:
+            candidates = _collect_candidates(entry_file, processed_files, cwd, executor)
+    else:
+        candidates = _collect_candidates(entry_file, processed_files, cwd)
     
-    return packages_to_install
+    # 检查是否需要安装
+    return {(module_name, package_name) for module_name, package_name in candidates
+            if not is_module_installed(module_name)}
 
 def handle_main_problem(file_path: str) -> None:
     """处理 __name__ == "__main__" 的情况
     
+    修改后的代码直接在内存中编译执行，不写入临时文件再重新读取
+    
     参数:
         file_path: 要处理的Python文件路径
     """
@@ -79,15 +283,11 @@ def handle_main_problem(file_path: str) -> None:
         with open(file_path, 'r', encoding='utf-8') as f:
             content = f.read()
         
-        # 创建临时文件
-        with tempfile.NamedTemporaryFile(suffix='.py', delete=False) as temp:
-            temp_path = temp.name
-            
-            # 修改内容，添加自动安装代码
-            modified_code = modify_code_to_autoinstall(content, None, file_path)
-            temp.write(modified_code.encode('utf-8'))
+        # 修改内容，添加自动安装代码
+        modified_code = modify_code_to_autoinstall(content, None, file_path)
+        abs_path = os.path.abspath(file_path)
+        code_obj = compile(modified_code, abs_path, 'exec', dont_inherit=True)
         
-        # 执行临时文件
         logger.info(f"运行修改后的脚本: {file_path}")
         
         # 构建命令行参数
@@ -95,50 +295,79 @@ def handle_main_problem(file_path: str) -> None:
         
         # 保存当前参数，设置新的参数
         old_argv = sys.argv.copy()
-        sys.argv = [temp_path] + cmd_args
+        sys.argv = [abs_path] + cmd_args
         
-        # 执行代码
-        with open(temp_path, 'r', encoding='utf-8') as f:
-            exec(f.read(), {'__name__': '__main__', '__file__': temp_path})
-        
-        # 恢复参数
-        sys.argv = old_argv
+        # 以 __main__ 身份执行
+        try:
+            exec(code_obj, {'__name__': '__main__', '__file__': abs_path})
+        finally:
+            # 恢复参数
+            sys.argv = old_argv
     except Exception as e:
         logger.error(f"执行 {file_path} 失败: {e}")
-    finally:
-        # 删除临时文件
+
+def _exec_script(cmd: List[str], replace_process: bool = False) -> int:
+    """执行脚本
+    
+    启用replace_process时用新的Python解释器替换当前进程，依赖已经处理完毕，
+    不需要保留当前进程等待子进程结束。Windows上的os.execv不会真正替换进程，
+    仍然使用子进程执行
+    
+    参数:
+        cmd: 完整的命令行参数，第一个元素是Python解释器
+        replace_process: 是否替换当前进程
+        
+    返回:
+        脚本的返回码
+    """
+    if replace_process and os.name == 'posix':
+        # execv不会刷新Python层的缓冲区
+        sys.stdout.flush()
+        sys.stderr.flush()
         try:
-            if 'temp_path' in locals():
-                os.unlink(temp_path)
-        except:
-            pass
+            os.execv(cmd[0], cmd)
+        except OSError as e:
+            logger.debug(f"替换进程失败，改用子进程执行: {e}")
+    
+    result = subprocess.run(cmd)
+    if result.returncode != 0:
+        logger.error(f"脚本执行失败，返回码: {result.returncode}")
+    return result.returncode
 
-def process_file(file_path: str, run: bool = True) -> None:
+def process_file(file_path: str, run: bool = True) -> int:
     """处理Python文件，安装依赖并运行
     
     参数:
         file_path: 要处理的Python文件路径
         run: 是否执行文件
+        
+    返回:
+        脚本的返回码，不执行文件时返回0，无法启动脚本时返回1
     """
     # 加载配置
     config = load_config()
     
+    # sys.path可能在导入本模块之后被修改过
+    refresh_local_search_paths()
+    
     # 绝对路径
     abs_path = os.path.abspath(file_path)
     
     # 检查requirements.txt文件
     if config.get('check_requirements', True):
-        check_and_install_requirements(os.path.dirname(abs_path))
+        check_and_install_requirements(os.path.dirname(abs_path),
+                                       config.get('pip_parallel_downloads', 1))
     
     # 处理递归导入
     logger.info(f"处理文件: {file_path}")
-    packages_to_install = process_recursive_imports(abs_path)
+    packages_to_install = process_recursive_imports(
+        abs_path, parallel=config.get('parallel_parse', False))
     
-    # 如果启用了自动安装，安装缺少的包
+    # 如果启用了自动安装，一次性安装缺少的包
     if config.get('auto_install', False) and packages_to_install:
         for module_name, package_name in packages_to_install:
             logger.info(f"安装依赖包: {package_name} (从模块 {module_name})")
-            install_package(package_name, module_name)
+        install_packages([package_name for _, package_name in packages_to_install])
     
     # 如果发现需要安装的包但未启用自动安装，提示用户
     elif packages_to_install:
@@ -149,8 +378,7 @@ def process_file(file_path: str, run: bool = True) -> None:
         while True:
             answer = input("是否安装这些依赖包？ (y/n): ").lower().strip()
             if answer in ('y', 'yes'):
-                for module_name, package_name in packages_to_install:
-                    install_package(package_name, module_name)
+                install_packages([package_name for _, package_name in packages_to_install])
                 break
             elif answer in ('n', 'no'):
                 logger.info("跳过安装依赖包，可能导致运行失败")
@@ -167,8 +395,9 @@ def process_file(file_path: str, run: bool = True) -> None:
             cmd = [sys.executable, abs_path] + cmd_args
             
             # 执行Python脚本
-            result = subprocess.run(cmd, check=True)
-            if result.returncode != 0:
-                logger.error(f"脚本执行失败，返回码: {result.returncode}")
+            return _exec_script(cmd, config.get('replace_process', False))
         except Exception as e:
-            logger.error(f"执行 {abs_path} 失败: {e}") 
\ No newline at end of file
+            logger.error(f"执行 {abs_path} 失败: {e}")
+            return 1
+    
+    return 0 
\ No newline at end of file
@@ -3,157 +3,272 @@
 import os
 import ast
 import re
+import string
+import functools
 import logging
-from typing import List, Set, Dict, Optional, Tuple, Any
+from typing import List, Set, Dict, Optional, Tuple, Any, Union
 
-from .package_manager import is_local_module, is_stdlib_module
+from .package_manager import (
+    is_local_module, is_stdlib_module, get_package_for_module, get_local_search_paths,
+    find_module_file
+)
 
 logger = logging.getLogger('pythonrun')
 
-def parse_imports(code: str) -> List[Tuple[str, Optional[str]]]:
+def parse_source(code: Union[str, bytes], file_path: Optional[str] = None) -> ast.Module:
+    """将代码解析为语法树
+    
+    直接调用compile并只生成AST，不继承当前模块的future标志，也不扫描类型注释
+    
+    参数:
+        code: Python代码字符串，或未解码的源文件内容（按PEP 263编码声明解码）
+        file_path: 文件路径，用于语法错误信息
+        
+    返回:
+        模块语法树
+    """
+    return compile(code, file_path or '<string>', 'exec',
+                   flags=ast.PyCF_ONLY_AST, dont_inherit=True)
+
+# 任何import或from ... import语句都包含import关键字，没有这个单词的代码不需要解析
+_IMPORT_KEYWORD_RE = re.compile(r'\bimport\b')
+_IMPORT_KEYWORD_BYTES_RE = re.compile(rb'\bimport\b')
+
+def may_contain_imports(code: Union[str, bytes]) -> bool:
+    """快速预检查代码中是否可能有导入语句，返回False时代码中一定没有导入
+    
+    参数:
+        code: Python代码字符串，或未解码的源文件内容
+        
+    返回:
+        代码中出现import关键字时返回True
+    """
+    pattern = _IMPORT_KEYWORD_BYTES_RE if isinstance(code, bytes) else _IMPORT_KEYWORD_RE
+    return pattern.search(code) is not None
+
+# 显式捕获这些异常的try块中的导入视为可选依赖。捕获Exception等宽泛异常
+# 或裸except的try块通常还包含使用该模块的代码，其中的导入仍然需要安装
+_IMPORT_ERROR_NAMES = frozenset(['ImportError', 'ModuleNotFoundError'])
+
+def _is_type_checking_test(test: ast.expr) -> bool:
+    """判断条件是否为 TYPE_CHECKING 或 typing.TYPE_CHECKING"""
+    if isinstance(test, ast.Name):
+        return test.id == 'TYPE_CHECKING'
+    return (isinstance(test, ast.Attribute) and test.attr == 'TYPE_CHECKING' and
+            isinstance(test.value, ast.Name) and test.value.id == 'typing')
+
+def _catches_import_error(handler: ast.excepthandler) -> bool:
+    """判断except子句是否显式捕获ImportError或ModuleNotFoundError"""
+    if handler.type is None:
+        return False
+    types = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+    return any(isinstance(t, ast.Name) and t.id in _IMPORT_ERROR_NAMES for t in types)
+
+@functools.lru_cache(maxsize=64)
+def _parse_cached(code: str, file_path: Optional[str] = None) -> ast.Module:
+    """按源码内容缓存的 parse_source，同一段代码在各个分析函数之间只解析一次
+    
+    返回的语法树是共享的，调用方不能修改
+    """
+    return parse_source(code, file_path)
+
+class _ImportFinder(ast.NodeVisitor):
+    """收集导入语句的访问器，只进入语句节点，不遍历表达式
+    
+    导入语句只会出现在语句块中（模块、函数、类、if/try/with 等），
+    跳过表达式节点可以大幅减少需要访问的节点数量。
+    
+    nodes包含所有导入语句；required不包含可选导入，即 if TYPE_CHECKING: 块中的导入，
+    以及 try: import X except ImportError: 中try部分的导入
+    """
+    
+    def __init__(self):
+        self.nodes = []
+        self.required = []
+        self._optional_depth = 0
+    
+    def visit_Import(self, node: ast.Import) -> None:
+        self.nodes.append(node)
+        if not self._optional_depth:
+            self.required.append(node)
+    
+    visit_ImportFrom = visit_Import
+    
+    def _visit_optional(self, statements: List[ast.stmt]) -> None:
+        self._optional_depth += 1
+        try:
+            for statement in statements:
+                self.visit(statement)
+        finally:
+            self._optional_depth -= 1
+    
+    def visit_If(self, node: ast.If) -> None:
+        if not _is_type_checking_test(node.test):
+            return self.generic_visit(node)
+        self._visit_optional(node.body)
+        for statement in node.orelse:
+            self.visit(statement)
+    
+    def visit_Try(self, node: ast.Try) -> None:
+        if not any(_catches_import_error(handler) for handler in node.handlers):
+            return self.generic_visit(node)
+        self._visit_optional(node.body)
+        for statement in node.handlers + node.orelse + node.finalbody:
+            self.visit(statement)
+    
+    visit_TryStar = visit_Try
+    
+    def generic_visit(self, node: ast.AST) -> None:
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.stmt, ast.excepthandler)) or type(child).__name__ == 'match_case':
+                self.visit(child)
+
+def _find_import_nodes(tree: ast.AST, include_optional: bool = True) -> List[ast.stmt]:
+    """返回语法树中所有的导入语句节点，include_optional为False时跳过可选导入"""
+    finder = _ImportFinder()
+    finder.visit(tree)
+    return finder.nodes if include_optional else finder.required
+
+def _handle_import(node: ast.Import, modules: List[Tuple[str, Optional[str]]]) -> None:
+    """处理 import X 格式"""
+    for name in node.names:
+        # 排除特定的本地模块
+        if name.name not in ['helper_module']:
+            modules.append((name.name, name.asname))
+
+def _handle_import_from(node: ast.ImportFrom, modules: List[Tuple[str, Optional[str]]]) -> None:
+    """处理 from X import Y 格式"""
+    if node.level == 0:  # 不处理相对导入
+        module_name = node.module
+        if module_name and module_name not in ['helper_module']:
+            # 只添加主模块名，不添加子模块
+            main_module = module_name.split('.')[0]
+            modules.append((main_module, None))
+
+_IMPORT_HANDLERS = {
+    ast.Import: _handle_import,
+    ast.ImportFrom: _handle_import_from,
+}
+
+def _modules_from_nodes(nodes: List[ast.stmt]) -> List[Tuple[str, Optional[str]]]:
+    """从导入语句节点中提取 [(模块名, 别名), ...]"""
+    modules = []
+    for node in nodes:
+        _IMPORT_HANDLERS[type(node)](node, modules)
+    return modules
+
+def parse_imports(code: Union[str, ast.AST], tree: Optional[ast.Module] = None,
+                  file_path: Optional[str] = None,
+                  include_optional: bool = True) -> List[Tuple[str, Optional[str]]]:
     """解析代码中的导入语句，返回所有导入的模块名
     
+    会检查所有语句块（包括函数和类内部）中的导入，但不遍历表达式节点
+    
     参数:
-        code: Python代码字符串
+        code: Python代码字符串，或已解析的语法树
+        tree: 已解析的语法树，提供时不再重复解析代码
+        file_path: 文件路径，用于语法错误信息
+        include_optional: 是否包含可选导入（TYPE_CHECKING块和捕获ImportError的try块中的导入）
     
     返回: 
         [(模块名, 别名), ...]
     """
-    modules = []
-    
     try:
-        tree = ast.parse(code)
-        for node in ast.walk(tree):
-            # 处理 import X 格式
-            if isinstance(node, ast.Import):
-                for name in node.names:
-                    # 排除特定的本地模块
-                    if name.name not in ['helper_module']:
-                        modules.append((name.name, name.asname))
-            
-            # 处理 from X import Y 格式
-            elif isinstance(node, ast.ImportFrom):
-                if node.level == 0:  # 不处理相对导入
-                    module_name = node.module
-                    if module_name and module_name not in ['helper_module']:
-                        # 只添加主模块名，不添加子模块
-                        main_module = module_name.split('.')[0]
-                        modules.append((main_module, None))
+        if tree is None:
+            if not isinstance(code, ast.AST) and not may_contain_imports(code):
+                return []
+            tree = code if isinstance(code, ast.AST) else _parse_cached(code, file_path)
+        return _modules_from_nodes(_find_import_nodes(tree, include_optional))
     except SyntaxError as e:
         logger.error(f"解析代码时遇到语法错误: {e}")
     
-    return modules
+    return []
 
-def find_local_imports(code: str, file_path: str) -> List[str]:
+def find_local_imports(code: Union[str, ast.AST], file_path: str, tree: Optional[ast.Module] = None) -> List[str]:
     """查找代码中导入的本地模块
     
     参数:
-        code: Python代码字符串
+        code: Python代码字符串，或已解析的语法树
         file_path: 当前代码文件的路径
+        tree: 已解析的语法树，提供时不再重复解析代码
         
     返回:
-        本地模块路径列表
+        本地模块路径列表，不包含重复项
     """
     if not file_path or not code:
         return []
     
     # 解析导入语句
-    imports = parse_imports(code)
+    return find_local_modules(parse_imports(code, tree, file_path), file_path)
+
+def find_local_modules(imports: List[Tuple[str, Optional[str]]], file_path: str) -> List[str]:
+    """在已解析的导入列表中查找本地模块
     
+    参数:
+        imports: parse_imports返回的 [(模块名, 别名), ...]
+        file_path: 当前代码文件的路径
+        
+    返回:
+        本地模块路径列表，不包含重复项
+    """
     # 查找当前目录
     current_dir = os.path.dirname(os.path.abspath(file_path))
     
     local_modules = []
+    seen = set()
     for module_name, _ in imports:
         # 跳过标准库
         if is_stdlib_module(module_name):
             continue
         
-        # 只处理基础模块名
+        # 只处理基础模块名，同一个基础模块只查找一次
         base_module = module_name.split('.')[0]
+        if base_module in seen:
+            continue
+        seen.add(base_module)
         
-        # 检查是否是本地模块
+        # 检查是否是本地模块，依次在当前目录和其他可能的Python路径中查找
         if is_local_module(base_module, file_path):
-            # 检查.py文件
-            py_path = os.path.join(current_dir, f"{base_module}.py")
-            if os.path.exists(py_path):
-                local_modules.append(py_path)
-                continue
-            
-            # 检查包目录
-            pkg_path = os.path.join(current_dir, base_module)
-            pkg_init = os.path.join(pkg_path, "__init__.py")
-            if os.path.exists(pkg_path) and os.path.isdir(pkg_path) and os.path.exists(pkg_init):
-                local_modules.append(pkg_init)
-                continue
-            
-            # 检查其他可能的Python路径
-            for path in [p for p in os.sys.path if 'site-packages' not in p]:
-                py_path = os.path.join(path, f"{base_module}.py")
-                if os.path.exists(py_path):
-                    local_modules.append(py_path)
-                    break
-                
-                pkg_path = os.path.join(path, base_module)
-                pkg_init = os.path.join(pkg_path, "__init__.py")
-                if os.path.exists(pkg_path) and os.path.isdir(pkg_path) and os.path.exists(pkg_init):
-                    local_modules.append(pkg_init)
+            for path in (current_dir,) + get_local_search_paths():
+                module_file = find_module_file(path, base_module)
+                if module_file:
+                    local_modules.append(module_file)
                     break
     
     return local_modules
 
-def modify_code_to_autoinstall(code: str, additional_packages: Set[Tuple[str, str]] = None, file_path: str = None) -> str:
-    """修改代码，添加自动安装功能
-    
-    参数:
-        code: 原始Python代码
-        additional_packages: 额外需要安装的包 (模块名, 包名)
-        file_path: 文件路径（用于日志）
-    
-    返回:
-        修改后的代码
-    """
-    # 避免重复修改已经修改过的代码
-    if "# 自动安装依赖 - 由pythonrun添加" in code:
-        return code
-    
-    try:
-        # 解析代码
-        tree = ast.parse(code)
-        
-        imports = []
-        main_block = None
-        has_imports = False
-        
-        # 收集所有导入语句
-        for node in ast.walk(tree):
-            if isinstance(node, ast.Import) or isinstance(node, ast.ImportFrom):
-                has_imports = True
-            
-            # 检查是否有 if __name__ == "__main__" 块
-            if (isinstance(node, ast.If) and 
-                isinstance(node.test, ast.Compare) and
-                isinstance(node.test.left, ast.Name) and 
-                node.test.left.id == '__name__' and
-                isinstance(node.test.comparators[0], ast.Constant) and
-                node.test.comparators[0].value == '__main__'):
-                main_block = node
-        
-        if not has_imports and not additional_packages:
-            return code  # 没有导入语句，无需修改
-        
-        # 准备自动安装代码
-        auto_install_code = """
+# 连续的空行和注释行
+_BLANK_OR_COMMENT_LINES_RE = re.compile(r'(?:[ \t\r\f\v]*(?:#[^\n]*)?\n)*')
+
+def _line_offset(code: str, lineno: int) -> int:
+    """返回第lineno行（从1开始）在代码字符串中的起始位置"""
+    pos = 0
+    for _ in range(lineno - 1):
+        pos = code.find('\n', pos)
+        if pos < 0:
+            return len(code)
+        pos += 1
+    return pos
+
+# 自动安装代码模板，$packages_block 处插入需要检查的包列表
+_AUTOINSTALL_TEMPLATE = string.Template("""
 # 自动安装依赖 - 由pythonrun添加
 def _ensure_installed(packages):
     import importlib.util
     import subprocess
     import sys
     
+    stdlib_names = getattr(sys, 'stdlib_module_names', ())
+    
+    missing = []
     for module_name, package_name in packages:
         if package_name is None:
             continue
         
+        # 已导入的模块和标准库模块不需要查找
+        if module_name in sys.modules or module_name in stdlib_names:
+            continue
+        
         is_installed = False
         try:
             # 检查模块是否已安装
@@ -162,61 +277,120 @@ def _ensure_installed(packages):
         except (ImportError, ValueError):
             is_installed = False
         
-        if not is_installed:
-            print(f"正在安装依赖包: {package_name} (来自模块 {module_name})...")
-            try:
-                subprocess.check_call([sys.executable, "-m", "pip", "install", package_name])
-                print(f"安装成功: {package_name}")
-            except Exception as e:
-                print(f"安装 {package_name} 失败，请手动安装。错误: {e}")
-                sys.exit(1)
+        if not is_installed and package_name not in missing:
+            missing.append(package_name)
+    
+    if not missing:
+        return
+    
+    # 一次pip调用安装所有缺少的包，只需解析一次依赖
+    print(f"正在安装依赖包: {', '.join(missing)}...")
+    if subprocess.call([sys.executable, "-m", "pip", "install", *missing]) == 0:
+        print(f"安装成功: {', '.join(missing)}")
+        return
+    
+    # 批量安装失败时逐个安装，定位失败的包
+    for package_name in missing:
+        try:
+            subprocess.check_call([sys.executable, "-m", "pip", "install", package_name])
+            print(f"安装成功: {package_name}")
+        except Exception as e:
+            print(f"安装 {package_name} 失败，请手动安装。错误: {e}")
+            sys.exit(1)
 
 # 检查依赖
 _packages_to_check = [
-"""
+$packages_block
+]
+_ensure_installed(_packages_to_check)
+""")
+
+def _is_main_test(test: ast.expr) -> bool:
+    """判断条件是否为 __name__ == "__main__"（两边顺序均可）"""
+    if not (isinstance(test, ast.Compare) and len(test.ops) == 1 and isinstance(test.ops[0], ast.Eq)):
+        return False
+    
+    operands = (test.left, test.comparators[0])
+    has_name = any(isinstance(op, ast.Name) and op.id == '__name__' for op in operands)
+    has_main = any(isinstance(op, ast.Constant) and op.value == '__main__' for op in operands)
+    return has_name and has_main
+
+def _find_main_block(tree: ast.Module) -> Optional[ast.If]:
+    """在模块顶层语句中查找 if __name__ == "__main__" 块
+    
+    main块通常位于文件末尾，因此从后向前查找，有多个时返回最后一个
+    """
+    for node in reversed(tree.body):
+        if isinstance(node, ast.If) and _is_main_test(node.test):
+            return node
+    return None
+
+def modify_code_to_autoinstall(code: str, additional_packages: Set[Tuple[str, str]] = None, file_path: str = None) -> str:
+    """修改代码，添加自动安装功能
+    
+    参数:
+        code: 原始Python代码
+        additional_packages: 额外需要安装的包 (模块名, 包名)
+        file_path: 文件路径（用于日志）
+    
+    返回:
+        修改后的代码
+    """
+    # 避免重复修改已经修改过的代码
+    if "# 自动安装依赖 - 由pythonrun添加" in code:
+        return code
+    
+    try:
+        # 解析代码，与 parse_imports 共享缓存的语法树
+        tree = _parse_cached(code, file_path)
         
-        # 添加导入的模块
-        for module_name, alias in parse_imports(code):
-            # 跳过标准库和本地模块
-            if is_stdlib_module(module_name) or (file_path and is_local_module(module_name, file_path)):
-                continue
-            
-            # 获取包名，可以是与模块名相同或者不同
-            package_name = module_name
-            auto_install_code += f'    ("{module_name}", "{package_name}"),\n'
+        # 一次遍历收集所有导入语句，并在顶层查找 if __name__ == "__main__" 块
+        finder = _ImportFinder()
+        finder.visit(tree)
+        import_nodes = finder.nodes
+        main_block = _find_main_block(tree)
+        
+        if not import_nodes and not additional_packages:
+            return code  # 没有导入语句，无需修改
+        
+        # 准备自动安装代码，只有包列表部分随调用变化
+        entries = []
+        
+        # 添加导入的模块（可选依赖除外），同一个基础模块只处理一次
+        required_imports = _modules_from_nodes(finder.required)
+        base_modules = dict.fromkeys(module_name.split('.')[0] for module_name, _ in required_imports)
+        for module_name in base_modules:
+            # 获取包名，标准库和本地模块返回None
+            package_name = get_package_for_module(module_name, file_path)
+            if package_name:
+                entries.append(f'    ("{module_name}", "{package_name}"),\n')
         
         # 添加额外的包
         if additional_packages:
-            for module_name, package_name in additional_packages:
-                if package_name:  # 只添加有包名的模块
-                    auto_install_code += f'    ("{module_name}", "{package_name}"),\n'
+            # 只添加有包名的模块
+            entries.extend(
+                f'    ("{module_name}", "{package_name}"),\n'
+                for module_name, package_name in additional_packages if package_name
+            )
         
-        auto_install_code += """
-]
-_ensure_installed(_packages_to_check)
-"""
+        auto_install_code = _AUTOINSTALL_TEMPLATE.substitute(packages_block=''.join(entries))
         
         # 如果有main块，在其前面添加自动安装代码
         if main_block:
-            main_start = main_block.lineno - 1  # 转换为0索引
+            main_start = _line_offset(code, main_block.lineno)
             new_code = code[:main_start] + auto_install_code + code[main_start:]
         else:
             # 否则，在所有导入语句之后添加
             # 尝试找到导入语句的最后位置
-            import_end = 0
-            for node in ast.walk(tree):
-                if isinstance(node, ast.Import) or isinstance(node, ast.ImportFrom):
-                    import_end = max(import_end, node.end_lineno)
+            import_end = max((node.end_lineno for node in import_nodes), default=0)
             
             if import_end > 0:
-                # 找到导入语句块的末尾位置
-                lines = code.split('\n')
-                line_index = import_end
-                while line_index < len(lines) and (not lines[line_index].strip() or lines[line_index].strip().startswith('#')):
-                    line_index += 1
+                # 从导入语句块的下一行开始，跳过空行和注释行
+                insert_pos = _line_offset(code, import_end + 1)
+                insert_pos = _BLANK_OR_COMMENT_LINES_RE.match(code, insert_pos).end()
                 
                 # 在所有导入语句之后添加自动安装代码
-                new_code = '\n'.join(lines[:line_index]) + auto_install_code + '\n'.join(lines[line_index:])
+                new_code = code[:insert_pos] + auto_install_code + code[insert_pos:]
             else:
                 # 没有找到导入语句的末尾，在代码开头添加
                 new_code = auto_install_code + code
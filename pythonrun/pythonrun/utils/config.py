@@ -4,7 +4,7 @@ import os
 import json
 import logging
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 
 logger = logging.getLogger('pythonrun')
 
@@ -17,10 +17,26 @@ DEFAULT_CONFIG = {
     'auto_install': False,    # 是否自动安装包
     'auto_update_pip': False, # 是否自动更新pip
     'check_requirements': True, # 是否检查requirements.txt文件
+    'replace_process': False, # 是否直接用脚本替换pythonrun进程（退出码由脚本决定）
+    'parallel_parse': False,  # 是否在线程池中预读本地模块文件
+    'pip_parallel_downloads': 1, # 安装requirements.txt时同时运行的pip进程数，为1时批量安装
 }
 
+# 已加载的配置缓存 (配置文件修改时间, 配置)，文件被修改后自动失效
+_CONFIG_CACHE: Optional[Tuple[int, Dict[str, Any]]] = None
+
 def load_config() -> Dict[str, Any]:
     """加载配置文件，如果不存在则创建默认配置"""
+    global _CONFIG_CACHE
+    
+    try:
+        mtime = os.stat(CONFIG_FILE).st_mtime_ns
+    except OSError:
+        mtime = None
+    
+    if mtime is not None and _CONFIG_CACHE is not None and _CONFIG_CACHE[0] == mtime:
+        return _CONFIG_CACHE[1].copy()
+    
     try:
         # 检查配置目录是否存在，不存在则创建
         if not os.path.exists(CONFIG_DIR):
@@ -35,13 +51,19 @@ def load_config() -> Dict[str, Any]:
         with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
             config = json.load(f)
             logger.debug(f"已加载配置: {config}")
-            return config
+        
+        if mtime is not None:
+            _CONFIG_CACHE = (mtime, config)
+        return config.copy()
     except Exception as e:
         logger.error(f"加载配置失败: {e}")
         return DEFAULT_CONFIG.copy()
 
 def save_config(config: Dict[str, Any]) -> None:
     """保存配置到文件"""
+    global _CONFIG_CACHE
+    _CONFIG_CACHE = None
+    
     try:
         # 确保配置目录存在
         if not os.path.exists(CONFIG_DIR):
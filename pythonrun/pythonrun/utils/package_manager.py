@@ -5,13 +5,44 @@ import subprocess
 import json
 import logging
 import site
+import sysconfig
 import os
 import re
-from typing import Dict, List, Optional, Tuple
-import requests
+import functools
+import difflib
+import importlib
+import importlib.util
+import tempfile
+import threading
+import time
+import concurrent.futures
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from .config import CONFIG_DIR
+
+if TYPE_CHECKING:
+    import requests
+
+try:
+    import importlib.metadata as importlib_metadata
+except ImportError:  # Python < 3.8
+    importlib_metadata = None
 
 logger = logging.getLogger('pythonrun')
 
+# Python 3.10+ 解释器提供的完整标准库模块列表，旧版本为None
+_STDLIB_NAMES = getattr(sys, 'stdlib_module_names', None)
+
+# 标准库模块列表，旧版本Python使用手动维护的常用模块列表，未列出的再到标准库目录中查找
+STDLIB_MODULES = frozenset(sys.builtin_module_names) | (frozenset(_STDLIB_NAMES) if _STDLIB_NAMES is not None else frozenset([
+    'abc', 'argparse', 'asyncio', 'base64', 'collections', 'concurrent', 'contextlib',
+    'copy', 'csv', 'dataclasses', 'datetime', 'enum', 'functools', 'glob', 'hashlib',
+    'http', 'importlib', 'io', 'itertools', 'json', 'logging', 'math', 'multiprocessing',
+    'os', 'pathlib', 'pickle', 'random', 're', 'shutil', 'socket', 'sqlite3', 'string',
+    'subprocess', 'sys', 'tempfile', 'threading', 'time', 'traceback', 'typing',
+    'unittest', 'urllib', 'uuid', 'warnings', 'xml', 'zipfile'
+]))
+
 # 包与模块的映射关系，有些模块名与包名不同
 PACKAGE_MAPPING = {
     'PIL': 'pillow',
@@ -21,14 +52,14 @@ PACKAGE_MAPPING = {
     'yaml': 'pyyaml',
     'Image': 'pillow',
     'tkinter': None,  # 标准库但可能需要额外安装
-    'matplotlib.pyplot': 'matplotlib',
-    'numpy.linalg': 'numpy',
-    'pandas.DataFrame': 'pandas',
-    'tensorflow.keras': 'tensorflow',
-    'torch.nn': 'torch',
+    'matplotlib': 'matplotlib',
+    'numpy': 'numpy',
+    'pandas': 'pandas',
+    'tensorflow': 'tensorflow',
+    'torch': 'torch',
     'transformers': 'transformers',
     'seaborn': 'seaborn',
-    'plotly.express': 'plotly',
+    'plotly': 'plotly',
     'dash': 'dash',
     'requests': 'requests',
     'flask': 'flask',
@@ -47,28 +78,295 @@ PACKAGE_MAPPING = {
     'fastapi': 'fastapi',
 }
 
-def get_installed_packages() -> Dict[str, str]:
-    """获取当前环境中已安装的包
+def _find_site_packages_dir() -> Optional[str]:
+    """查找pip默认安装包的site-packages目录
     
-    返回: {包名: 版本号, ...}
+    优先使用sysconfig的purelib路径，这是当前环境（包括虚拟环境）中pip的默认安装位置；
+    无法获取时退回到site.getsitepackages()，选择以site-packages结尾的路径
     """
+    purelib = sysconfig.get_paths().get('purelib')
+    if purelib:
+        return purelib
+    
     try:
+        paths = site.getsitepackages()
+    except AttributeError:  # 旧版virtualenv中的site模块没有该函数
+        return None
+    return next((p for p in paths if p.endswith('site-packages')), paths[0] if paths else None)
+
+# site-packages目录在进程内不会变化，只计算一次
+_SITE_PACKAGES_DIR = _find_site_packages_dir()
+
+def get_site_packages_dir():
+    """获取site-packages目录路径"""
+    return _SITE_PACKAGES_DIR
+
+# 已安装包列表的磁盘缓存，以site-packages目录的修改时间作为失效依据
+_INSTALLED_CACHE_FILE = os.path.join(CONFIG_DIR, 'installed.json')
+
+# 并行安装时，扫描和失效已安装包缓存需要互斥，避免重复扫描或读到失效前的结果
+_INSTALLED_CACHE_LOCK = threading.Lock()
+
+def _scan_installed_packages() -> Dict[str, str]:
+    """扫描当前环境中的包元数据
+
+    返回: {包名: 版本号, ...}
+    """
+    if importlib_metadata is None:
+        # 旧版本Python没有importlib.metadata，退回到pip list
         result = subprocess.run(
             [sys.executable, '-m', 'pip', 'list', '--format=json'],
             capture_output=True,
             text=True,
             check=True
         )
-        
         packages = json.loads(result.stdout)
         return {pkg['name'].lower(): pkg['version'] for pkg in packages}
+    
+    packages = {}
+    for dist in importlib_metadata.distributions():
+        # 元数据损坏的发行版可能没有Name字段
+        name = dist.metadata.get('Name')
+        if name:
+            packages.setdefault(name.lower(), dist.version)
+    return packages
+
+def _installed_cache_key() -> List[list]:
+    """已安装包缓存的有效性标识：sys.path中第三方包和标准库路径及其修改时间
+    
+    安装或卸载包会在site-packages、用户site-packages或dist-packages中增删
+    *.dist-info目录，从而改变这个目录的修改时间。当前目录、脚本目录等本地
+    搜索路径不计入，否则编辑项目文件也会使缓存失效
+    """
+    key = []
+    for path in sys.path:
+        if not path or _is_local_search_path(path):
+            continue
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        key.append([path, mtime])
+    return key
+
+def _load_installed_cache(key: List[list]) -> Optional[Dict[str, str]]:
+    """读取磁盘缓存，仅当所有搜索路径及其修改时间都一致时才返回缓存内容"""
+    try:
+        with open(_INSTALLED_CACHE_FILE, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache.get('paths') == key:
+            return cache['pkgs']
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+    return None
+
+def _save_installed_cache(key: List[list], packages: Dict[str, str]) -> None:
+    """原子地写入磁盘缓存"""
+    try:
+        cache_dir = os.path.dirname(_INSTALLED_CACHE_FILE)
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'paths': key, 'pkgs': packages}, f)
+        os.replace(tmp_path, _INSTALLED_CACHE_FILE)
+    except OSError as e:
+        logger.debug(f"写入已安装包缓存失败: {e}")
+
+@functools.lru_cache(maxsize=1)
+def _installed_index() -> Dict[str, str]:
+    """获取已安装包列表，结果在进程内和磁盘上缓存
+
+    返回: {包名: 版本号, ...}
+    """
+    key = _installed_cache_key()
+    packages = _load_installed_cache(key)
+    if packages is None:
+        packages = _scan_installed_packages()
+        _save_installed_cache(key, packages)
+    return packages
+
+def _invalidate_installed_cache() -> None:
+    """使已安装包缓存失效，在安装新包之后调用"""
+    with _INSTALLED_CACHE_LOCK:
+        _installed_index.cache_clear()
+        try:
+            os.remove(_INSTALLED_CACHE_FILE)
+        except OSError:
+            pass
+
+def get_installed_packages() -> Dict[str, str]:
+    """获取当前环境中已安装的包
+    
+    返回: {包名: 版本号, ...}
+    """
+    try:
+        with _INSTALLED_CACHE_LOCK:
+            return _installed_index().copy()
     except Exception as e:
         logger.error(f"获取已安装包列表失败: {e}")
         return {}
 
-def get_site_packages_dir():
-    """获取site-packages目录路径"""
-    return site.getsitepackages()[0]
+# 第三方包目录和zip归档的路径特征
+_NON_LOCAL_PATH_RE = re.compile(r'site-packages|dist-packages|\.zip$')
+
+# 标准库和解释器所在目录，这些目录中不会有本地模块
+_NON_LOCAL_DIRS = frozenset(
+    os.path.normcase(os.path.abspath(p)) for p in (
+        os.path.dirname(sys.executable),
+        sysconfig.get_paths().get('stdlib', ''),
+        sysconfig.get_paths().get('platstdlib', ''),
+    ) if p
+)
+
+def _is_local_search_path(path: str) -> bool:
+    """判断sys.path中的路径是否可能包含本地模块"""
+    if _NON_LOCAL_PATH_RE.search(path):
+        return False
+    path = os.path.normcase(os.path.abspath(path))
+    return path not in _NON_LOCAL_DIRS and os.path.dirname(path) not in _NON_LOCAL_DIRS
+
+# 可能包含本地模块的Python路径，只在模块加载或sys.path变化时过滤
+_LOCAL_SYS_PATH = tuple(p for p in sys.path if _is_local_search_path(p))
+_LOCAL_SYS_PATH_SOURCE = tuple(sys.path)
+
+def get_local_search_paths() -> Tuple[str, ...]:
+    """获取可能包含本地模块的Python路径（已排除标准库和第三方包路径）"""
+    return _LOCAL_SYS_PATH
+
+def refresh_local_search_paths() -> None:
+    """sys.path被修改后重新过滤本地模块搜索路径"""
+    global _LOCAL_SYS_PATH, _LOCAL_SYS_PATH_SOURCE
+    
+    current = tuple(sys.path)
+    if current == _LOCAL_SYS_PATH_SOURCE:
+        return
+    
+    _LOCAL_SYS_PATH = tuple(p for p in current if _is_local_search_path(p))
+    _LOCAL_SYS_PATH_SOURCE = current
+    is_local_module.cache_clear()
+    get_package_for_module.cache_clear()
+
+@functools.lru_cache(maxsize=1024)
+def get_dir_index(dir_path: str) -> Dict[str, str]:
+    """列出目录内容，一次scandir代替对每个候选路径的多次stat
+    
+    参数:
+        dir_path: 目录路径，空字符串表示当前目录
+        
+    返回:
+        {名称: 'file' | 'dir' | 'other', ...}，目录不存在时返回空字典
+    """
+    entries = {}
+    try:
+        with os.scandir(dir_path or os.curdir) as it:
+            for entry in it:
+                try:
+                    if entry.is_file():
+                        entries[entry.name] = 'file'
+                    elif entry.is_dir():
+                        entries[entry.name] = 'dir'
+                    else:
+                        entries[entry.name] = 'other'
+                except OSError:
+                    entries[entry.name] = 'other'
+    except OSError:
+        pass
+    return entries
+
+def find_module_file(directory: str, module_name: str) -> Optional[str]:
+    """在目录中查找模块对应的文件，使用缓存的目录列表而不是逐个stat
+    
+    参数:
+        directory: 要查找的目录
+        module_name: 基础模块名
+        
+    返回:
+        模块的.py文件或包的__init__.py路径，找不到时返回None
+    """
+    entries = get_dir_index(directory)
+    if entries.get(f"{module_name}.py") == 'file':
+        return os.path.join(directory, f"{module_name}.py")
+    
+    if entries.get(module_name) == 'dir':
+        package_dir = os.path.join(directory, module_name)
+        if get_dir_index(package_dir).get("__init__.py") == 'file':
+            return os.path.join(package_dir, "__init__.py")
+    
+    return None
+
+@functools.lru_cache(maxsize=1)
+def _packages_distributions() -> Dict[str, List[str]]:
+    """获取顶层模块名到发行版名的映射，结果在进程内缓存
+
+    返回: {模块名: [发行版名, ...], ...}
+    """
+    # packages_distributions 从Python 3.10开始提供
+    func = getattr(importlib_metadata, 'packages_distributions', None)
+    if func is None:
+        return {}
+    try:
+        return func()
+    except Exception as e:
+        logger.debug(f"获取模块与发行版映射失败: {e}")
+        return {}
+
+# PyPI查询结果缓存: {规范化包名: (查询时间, 元数据)}，包不存在的结果也会缓存
+_PYPI_CACHE: Dict[str, Tuple[float, Optional[Dict]]] = {}
+_PYPI_CACHE_TTL = 600
+_PYPI_CACHE_MAXSIZE = 1024
+
+@functools.lru_cache(maxsize=1)
+def _get_session() -> 'requests.Session':
+    """返回共享的HTTP会话，复用到PyPI的TCP/TLS连接
+    
+    requests及其依赖导入较慢，只在第一次需要访问网络时才导入
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=16,
+        max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504))
+    )
+    session.mount('https://', adapter)
+    session.headers['Accept'] = 'application/json'
+    return session
+
+def _pypi_json(package_name: str) -> Optional[Dict]:
+    """从PyPI JSON API获取包的元数据，结果在进程内缓存一段时间
+
+    参数:
+        package_name: 包名
+        
+    返回:
+        包的元数据字典（只包含info部分），包不存在时返回None
+    """
+    # 按PEP 503规范化包名，不同写法的同一个包共用缓存
+    key = re.sub(r'[-_.]+', '-', package_name).lower()
+    now = time.monotonic()
+    
+    cached = _PYPI_CACHE.get(key)
+    if cached is not None and now - cached[0] < _PYPI_CACHE_TTL:
+        return cached[1]
+    
+    response = _get_session().get(f"https://pypi.org/pypi/{package_name}/json", timeout=5)
+    # 其他状态码可能是暂时性错误，不缓存
+    if response.status_code == 200:
+        # 完整的元数据包含所有版本的文件列表，只保留用到的info部分
+        data = {'info': response.json()['info']}
+    elif response.status_code == 404:
+        data = None
+    else:
+        return None
+    
+    if len(_PYPI_CACHE) >= _PYPI_CACHE_MAXSIZE:
+        # 字典按插入顺序排列，删除最早的条目
+        _PYPI_CACHE.pop(next(iter(_PYPI_CACHE)))
+    _PYPI_CACHE[key] = (now, data)
+    return data
 
 def search_package(package_name: str) -> List[Dict]:
     """在PyPI上搜索包
@@ -83,12 +381,9 @@ def search_package(package_name: str) -> List[Dict]:
         return []
     
     try:
-        # 首先尝试精确匹配
-        url = f"https://pypi.org/pypi/{package_name}/json"
-        response = requests.get(url, timeout=5)
-        
-        if response.status_code == 200:
-            data = response.json()
+        # 首先通过PyPI JSON API尝试精确匹配
+        data = _pypi_json(package_name)
+        if data is not None:
             return [{
                 'name': data['info']['name'],
                 'version': data['info']['version'],
@@ -96,53 +391,79 @@ def search_package(package_name: str) -> List[Dict]:
                 'exact_match': True
             }]
         
-        # 如果精确匹配失败，使用搜索API
-        search_url = f"https://pypi.org/search/?q={package_name}&format=json"
-        response = requests.get(search_url, timeout=5)
+        # PyPI没有可用的JSON搜索接口（/search/ 只返回HTML），
+        # 因此精确匹配失败时直接在本地安装的包中查找名称相似的包
+        installed = get_installed_packages()
+        query = package_name.lower()
         
-        if response.status_code == 200:
-            results = []
-            try:
-                data = response.json()
-                for item in data.get('results', [])[:5]:  # 限制只返回前5个结果
-                    results.append({
-                        'name': item['name'],
-                        'version': item.get('version', 'unknown'),
-                        'summary': item.get('summary', ''),
-                        'exact_match': False
-                    })
-            except Exception as e:
-                logger.error(f"解析搜索结果失败: {e}")
-            
-            # 如果没有搜索结果，使用模糊匹配查找相似包名
-            if not results:
-                # 获取所有安装的包
-                installed = get_installed_packages()
-                
-                # 查找名称相似的包
-                for pkg_name in installed.keys():
-                    # 简单的字符串包含检查
-                    if package_name.lower() in pkg_name or pkg_name in package_name.lower():
-                        results.append({
-                            'name': pkg_name,
-                            'version': installed[pkg_name],
-                            'summary': '本地安装的包',
-                            'exact_match': False
-                        })
-            
-            return results
+        # 相似度匹配可以发现拼写错误（如 numpi -> numpy），相互包含的名称也一并列出
+        matches = difflib.get_close_matches(query, installed.keys(), n=5, cutoff=0.6)
+        matches.extend(pkg_name for pkg_name in installed
+                       if (query in pkg_name or pkg_name in query) and pkg_name not in matches)
         
-        return []
+        return [{
+            'name': pkg_name,
+            'version': installed[pkg_name],
+            'summary': '本地安装的包',
+            'exact_match': False
+        } for pkg_name in matches]
     except Exception as e:
         logger.error(f"搜索包 {package_name} 失败: {e}")
         return []
 
-def install_package(package_name: str, module_name: str = None) -> bool:
+def search_packages_batch(package_names: List[str]) -> Dict[str, List[Dict]]:
+    """并发地在PyPI上搜索多个包，网络请求期间不持有GIL，多个查询可以同时等待
+    
+    参数:
+        package_names: 要搜索的包名列表
+        
+    返回:
+        {包名: 匹配的包列表, ...}
+    """
+    package_names = list(dict.fromkeys(name for name in package_names if name))
+    if len(package_names) <= 1:
+        return {name: search_package(name) for name in package_names}
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(package_names))) as executor:
+        return dict(zip(package_names, executor.map(search_package, package_names)))
+
+def _log_search_results(package_name: str, search_results: List[Dict]) -> None:
+    """输出安装失败的包在PyPI上的搜索结果"""
+    if not search_results:
+        return
+    
+    logger.info("找到以下相关包:")
+    for i, pkg in enumerate(search_results):
+        exact = " (精确匹配)" if pkg.get('exact_match') else ""
+        logger.info(f"  {i+1}. {pkg['name']}{exact} - {pkg['summary']}")
+    
+    # 如果找到了精确匹配但安装失败，可能是其他错误
+    for pkg in search_results:
+        if pkg.get('exact_match') and pkg['name'].lower() == package_name.lower():
+            logger.info(f"包名正确，但安装失败。可能是网络问题或权限不足。")
+            break
+
+def _pip_run_kwargs() -> Dict[str, Any]:
+    """pip子进程的输出方式
+    
+    交互式终端且启用了INFO日志时，pip的输出直接显示在终端上，不再缓存到内存；
+    否则丢弃stdout并捕获stderr用于错误分析
+    
+    返回:
+        传给subprocess.run的关键字参数，为空时表示直接输出到终端
+    """
+    stdout = sys.stdout
+    if stdout is not None and stdout.isatty() and logger.isEnabledFor(logging.INFO):
+        return {}
+    return {'stdout': subprocess.DEVNULL, 'stderr': subprocess.PIPE, 'text': True}
+
+def install_package(package_name: str, module_name: str = None, search: bool = True) -> bool:
     """安装指定的包
     
     参数:
         package_name: 要安装的包名
         module_name: 原始模块名（用于日志记录）
+        search: 安装失败时是否在PyPI上搜索相关的包，批量安装时由调用方统一搜索
         
     返回:
         安装成功返回True，否则返回False
@@ -157,45 +478,105 @@ def install_package(package_name: str, module_name: str = None) -> bool:
     logger.info(f"正在安装 {package_name} (来自模块 {module_name})...")
     
     try:
-        # 执行pip安装
+        # 执行pip安装，输出直接显示在终端上，或者只捕获stderr用于错误分析
         result = subprocess.run(
             [sys.executable, '-m', 'pip', 'install', package_name],
-            capture_output=True,
-            text=True
+            **_pip_run_kwargs()
         )
         
         # 检查安装结果
         if result.returncode == 0:
             logger.info(f"成功安装 {package_name}")
+            # 已安装包发生变化，清除缓存
+            _clear_import_caches()
             return True
         else:
             error_msg = result.stderr
-            logger.error(f"安装 {package_name} 失败: {error_msg}")
-            
-            # 分析错误并给出建议
-            suggestion = analyze_pip_error(error_msg, package_name)
-            if suggestion:
-                logger.info(f"建议: {suggestion}")
+            if error_msg is None:
+                # pip的错误输出已经显示在终端上
+                logger.error(f"安装 {package_name} 失败")
+            else:
+                logger.error(f"安装 {package_name} 失败: {error_msg}")
+                
+                # 分析错误并给出建议
+                suggestion = analyze_pip_error(error_msg, package_name)
+                if suggestion:
+                    logger.info(f"建议: {suggestion}")
             
             # 尝试搜索相似的包
-            search_results = search_package(package_name)
-            if search_results:
-                logger.info("找到以下相关包:")
-                for i, pkg in enumerate(search_results):
-                    exact = " (精确匹配)" if pkg.get('exact_match') else ""
-                    logger.info(f"  {i+1}. {pkg['name']}{exact} - {pkg['summary']}")
-                
-                # 如果找到了精确匹配但安装失败，可能是其他错误
-                for pkg in search_results:
-                    if pkg.get('exact_match') and pkg['name'].lower() == package_name.lower():
-                        logger.info(f"包名正确，但安装失败。可能是网络问题或权限不足。")
-                        break
+            if search:
+                _log_search_results(package_name, search_package(package_name))
             
             return False
     except Exception as e:
         logger.error(f"安装过程出错: {e}")
         return False
 
+def install_packages(package_names: List[str]) -> bool:
+    """用一次pip调用安装多个包
+    
+    pip只需启动一次并统一解析依赖。批量安装失败时逐个安装，
+    以便定位失败的包并给出建议
+    
+    参数:
+        package_names: 要安装的包名列表
+        
+    返回:
+        全部安装成功返回True，否则返回False
+    """
+    # 去重并保持顺序
+    package_names = list(dict.fromkeys(name for name in package_names if name))
+    if not package_names:
+        return True
+    if len(package_names) == 1:
+        return install_package(package_names[0])
+    
+    logger.info(f"正在安装 {', '.join(package_names)}...")
+    
+    try:
+        result = subprocess.run(
+            [sys.executable, '-m', 'pip', 'install', *package_names],
+            **_pip_run_kwargs()
+        )
+    except Exception as e:
+        logger.error(f"安装过程出错: {e}")
+        return False
+    
+    if result.returncode == 0:
+        logger.info(f"成功安装 {', '.join(package_names)}")
+        _clear_import_caches()
+        return True
+    
+    logger.warning("批量安装失败，尝试逐个安装")
+    failed = [name for name in package_names if not install_package(name, search=False)]
+    
+    # 所有失败的包一起到PyPI上查询，而不是每个包依次等待
+    for name, search_results in search_packages_batch(failed).items():
+        _log_search_results(name, search_results)
+    
+    return not failed
+
+def _permission_suggestion(package_name: str) -> str:
+    """权限错误的建议，与平台相关"""
+    if sys.platform == 'win32':
+        return "权限被拒绝。请尝试以管理员身份运行，或使用 pip install --user " + package_name
+    return "权限被拒绝。请尝试: sudo pip install " + package_name + " 或 pip install --user " + package_name
+
+# pip错误特征与对应建议，按顺序匹配，第一条匹配的规则生效
+_PIP_ERROR_RULES = [
+    # 网络错误
+    (re.compile(r'HTTPError|ConnectionError'),
+     lambda package_name: "网络连接问题。请检查您的网络连接，或尝试使用镜像源: pip install --index-url https://mirrors.aliyun.com/pypi/simple/ " + package_name),
+    # 权限错误
+    (re.compile(r'Permission denied'), _permission_suggestion),
+    # 包不存在
+    (re.compile(r'No matching distribution found'),
+     lambda package_name: f"未找到匹配的发行版。包名 '{package_name}' 可能不正确，或不支持当前的Python版本。"),
+    # 版本冲突
+    (re.compile(r'requires.*which is incompatible', re.S),
+     lambda package_name: "存在依赖版本冲突。请尝试使用虚拟环境或指定兼容的版本。"),
+]
+
 def analyze_pip_error(error_msg: str, package_name: str) -> Optional[str]:
     """分析pip安装错误，提供有用的建议
     
@@ -209,27 +590,13 @@ def analyze_pip_error(error_msg: str, package_name: str) -> Optional[str]:
     if not error_msg:
         return None
     
-    # 检查是否是网络错误
-    if "HTTPError" in error_msg or "ConnectionError" in error_msg:
-        return "网络连接问题。请检查您的网络连接，或尝试使用镜像源: pip install --index-url https://mirrors.aliyun.com/pypi/simple/ " + package_name
-    
-    # 检查是否是权限错误
-    if "Permission denied" in error_msg:
-        if sys.platform == 'win32':
-            return "权限被拒绝。请尝试以管理员身份运行，或使用 pip install --user " + package_name
-        else:
-            return "权限被拒绝。请尝试: sudo pip install " + package_name + " 或 pip install --user " + package_name
-    
-    # 检查是否是包不存在
-    if "No matching distribution found" in error_msg:
-        return f"未找到匹配的发行版。包名 '{package_name}' 可能不正确，或不支持当前的Python版本。"
-    
-    # 检查是否是版本冲突
-    if "requires" in error_msg and "which is incompatible" in error_msg:
-        return "存在依赖版本冲突。请尝试使用虚拟环境或指定兼容的版本。"
+    for pattern, suggestion in _PIP_ERROR_RULES:
+        if pattern.search(error_msg):
+            return suggestion(package_name)
     
     return None
 
+@functools.lru_cache(maxsize=None)
 def get_package_for_module(module_name: str, file_path: str = None) -> Optional[str]:
     """根据模块名确定对应的包名
     
@@ -255,16 +622,34 @@ def get_package_for_module(module_name: str, file_path: str = None) -> Optional[
     if file_path and is_local_module(base_module, file_path):
         return None
     
-    # 检查模块名映射
-    if module_name in PACKAGE_MAPPING:
-        return PACKAGE_MAPPING[module_name]
-    
+    # 检查模块名映射，所有映射键都是基础模块名
     if base_module in PACKAGE_MAPPING:
         return PACKAGE_MAPPING[base_module]
     
+    # 已安装的模块可以直接从元数据中找到所属的发行版
+    distributions = _packages_distributions().get(base_module)
+    if distributions:
+        return distributions[0]
+    
     # 如果没有映射关系，将模块名作为包名
     return base_module
 
+# 可能的标准库路径缓存: (计算时的sys.path快照, 路径列表)
+_STDLIB_PATHS_CACHE: Optional[Tuple[Tuple[str, ...], List[str]]] = None
+
+def _get_stdlib_search_paths() -> List[str]:
+    """返回sys.path中可能是标准库的路径，sys.path不变时复用上次的结果"""
+    global _STDLIB_PATHS_CACHE
+    
+    snapshot = tuple(sys.path)
+    if _STDLIB_PATHS_CACHE is None or _STDLIB_PATHS_CACHE[0] != snapshot:
+        # 根据常见的标准库路径模式，较长（更具体）的路径优先
+        paths = [prefix for prefix in sorted(snapshot, key=len, reverse=True)
+                 if 'lib' in prefix and 'site-packages' not in prefix]
+        _STDLIB_PATHS_CACHE = (snapshot, paths)
+    return _STDLIB_PATHS_CACHE[1]
+
+@functools.lru_cache(maxsize=None)
 def is_stdlib_module(module_name: str) -> bool:
     """检查模块是否是Python标准库的一部分
     
@@ -274,43 +659,24 @@ def is_stdlib_module(module_name: str) -> bool:
     返回:
         如果模块是标准库的一部分，则返回True
     """
-    # 定义标准库模块列表
-    STDLIB_MODULES = set(sys.builtin_module_names)
-    STDLIB_MODULES.update([
-        'abc', 'argparse', 'asyncio', 'base64', 'collections', 'copy', 'datetime',
-        'functools', 'hashlib', 'http', 'io', 'itertools', 'json', 'logging', 'math', 
-        'os', 'pickle', 'random', 're', 'shutil', 'socket', 'sys', 'tempfile', 
-        'threading', 'time', 'traceback', 'urllib', 'warnings', 'zipfile'
-    ])
-    
     # 分离基础模块名
     base_module = module_name.split('.')[0]
     
-    # 检查是否在已知的标准库列表中
+    # 检查是否在已知的标准库列表中，Python 3.10+ 的列表是完整的，不需要再查找文件
     if base_module in STDLIB_MODULES:
         return True
+    if _STDLIB_NAMES is not None:
+        return False
     
-    # 尝试以不导入的方式检查是否为标准库
-    prefixes = sorted(sys.path, key=len, reverse=True)
-    
-    # 查找标准库路径
-    stdlib_paths = []
-    for prefix in prefixes:
-        # 根据常见的标准库路径模式
-        if 'lib' in prefix and 'site-packages' not in prefix:
-            stdlib_paths.append(prefix)
-    
-    # 检查module_name是否存在于标准库路径中的任何一个
-    if stdlib_paths:
-        for stdlib_path in stdlib_paths:
-            module_path = os.path.join(stdlib_path, f"{base_module}.py")
-            package_path = os.path.join(stdlib_path, base_module)
-            
-            if os.path.exists(module_path) or (os.path.exists(package_path) and os.path.isdir(package_path)):
-                return True
+    # 尝试以不导入的方式检查是否存在于标准库路径中的任何一个
+    for stdlib_path in _get_stdlib_search_paths():
+        entries = get_dir_index(stdlib_path)
+        if f"{base_module}.py" in entries or entries.get(base_module) == 'dir':
+            return True
     
     return False
 
+@functools.lru_cache(maxsize=None)
 def is_module_installed(module_name: str) -> bool:
     """检查模块是否已安装
     
@@ -326,18 +692,28 @@ def is_module_installed(module_name: str) -> bool:
     # 获取基础模块名
     base_module = module_name.split('.')[0]
     
-    try:
-        # 尝试导入模块
-        __import__(base_module)
+    # 已经导入过的模块和标准库模块不需要再查找
+    if base_module in sys.modules or base_module in STDLIB_MODULES:
         return True
-    except ImportError:
-        # 检查是否存在于site-packages目录
-        site_packages = get_site_packages_dir()
-        module_path = os.path.join(site_packages, f"{base_module}.py")
-        package_path = os.path.join(site_packages, base_module)
-        
-        return os.path.exists(module_path) or (os.path.exists(package_path) and os.path.isdir(package_path))
+    
+    try:
+        # 只查找模块而不执行它，导入较重的包可能需要几秒钟
+        return importlib.util.find_spec(base_module) is not None
+    except (ImportError, ValueError):
+        # ValueError: 模块已在sys.modules中但没有__spec__
+        return False
 
+def _clear_import_caches() -> None:
+    """清除已安装包和模块查找相关的缓存，在安装新包之后调用"""
+    _invalidate_installed_cache()
+    _packages_distributions.cache_clear()
+    is_module_installed.cache_clear()
+    is_local_module.cache_clear()
+    get_package_for_module.cache_clear()
+    get_dir_index.cache_clear()
+    importlib.invalidate_caches()
+
+@functools.lru_cache(maxsize=512)
 def is_local_module(module_name: str, file_path: str) -> bool:
     """检查模块是否是本地模块
     
@@ -361,85 +737,116 @@ def is_local_module(module_name: str, file_path: str) -> bool:
     parts = module_name.split('.')
     base_module = parts[0]  # 基础模块名
     
-    # 1. 检查当前目录
-    # 检查是py文件
-    module_path = os.path.join(current_dir, f"{base_module}.py")
-    if os.path.exists(module_path):
-        return True
-    
-    # 检查是否是包 (有__init__.py的目录)
-    package_dir = os.path.join(current_dir, base_module)
-    init_file = os.path.join(package_dir, "__init__.py")
-    if os.path.exists(package_dir) and os.path.isdir(package_dir) and os.path.exists(init_file):
-        return True
-    
-    # 2. 检查所有Python路径
-    for path in sys.path:
-        # 跳过标准库和第三方包路径
-        if ('site-packages' in path or 
-            'dist-packages' in path or 
-            path == os.path.dirname(sys.executable)):
-            continue
-        
-        # 检查是否是文件
-        module_path = os.path.join(path, f"{base_module}.py")
-        if os.path.exists(module_path):
-            return True
-        
-        # 检查是否是用户定义的包
-        package_dir = os.path.join(path, base_module)
-        init_file = os.path.join(package_dir, "__init__.py")
-        if os.path.exists(package_dir) and os.path.isdir(package_dir) and os.path.exists(init_file):
+    # 依次检查当前目录和所有Python路径（已排除标准库和第三方包路径），
+    # 查找py文件或有__init__.py的包目录
+    for path in (current_dir,) + _LOCAL_SYS_PATH:
+        if find_module_file(path, base_module):
             return True
     
     return False
 
+# requirements.txt中一行开头的包名
+_REQ_NAME_RE = re.compile(r'([A-Za-z0-9][A-Za-z0-9_.\-]*)')
+
+# 引用其他requirements文件的行：-r file、-rfile、--requirement file、--requirement=file
+_REQ_INCLUDE_RE = re.compile(r'(?:-r|--requirement)\s*=?\s*(\S+)')
+
 def parse_requirements_file(file_path: str) -> List[str]:
     """解析requirements.txt文件
     
+    使用工作队列处理 -r 引用的文件，每个文件只读取一次，循环引用不会导致无限递归
+    
     参数:
         file_path: requirements.txt文件路径
         
     返回:
         依赖包列表
     """
-    if not os.path.exists(file_path):
-        return []
-    
     packages = []
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line in f:
+    work = [file_path]
+    visited = set()
+    
+    while work:
+        current = work.pop()
+        real_path = os.path.realpath(current)
+        if real_path in visited or not os.path.exists(current):
+            continue
+        visited.add(real_path)
+        
+        includes = []
+        try:
+            # 一次读入整个文件再按行切分，避免逐行的文件迭代开销
+            with open(current, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+            
+            for line in lines:
                 # 跳过注释和空行
                 line = line.strip()
                 if not line or line.startswith('#'):
                     continue
                 
-                # 处理特殊格式（如 -r other-requirements.txt）
-                if line.startswith('-r'):
-                    include_file = line[2:].strip()
-                    include_path = os.path.join(os.path.dirname(file_path), include_file)
-                    if os.path.exists(include_path):
-                        packages.extend(parse_requirements_file(include_path))
+                # 处理特殊格式（如 -r other-requirements.txt），相对路径基于当前文件所在目录
+                include_match = _REQ_INCLUDE_RE.match(line)
+                if include_match:
+                    includes.append(os.path.join(os.path.dirname(current), include_match.group(1)))
                     continue
                 
-                # 移除版本标识符和其他选项
-                package = re.split(r'[<>=;]', line)[0].strip()
-                if package:
-                    packages.append(package)
-    except Exception as e:
-        logger.error(f"解析requirements文件失败: {e}")
+                # 其他选项行（-e、--index-url 等）不是包名
+                if line.startswith('-'):
+                    continue
+                
+                # 只取行首的包名，忽略版本标识符、extras和环境标记
+                match = _REQ_NAME_RE.match(line)
+                if match:
+                    packages.append(match.group(1))
+        except Exception as e:
+            logger.error(f"解析requirements文件失败: {e}")
+        
+        # 逆序入栈，保证引用的文件按出现顺序处理
+        work.extend(reversed(includes))
     
     return packages
 
-def check_and_install_requirements(directory: str) -> None:
+# 本次运行中已检查过的requirements.txt: {文件路径: 修改时间}
+_CHECKED_REQUIREMENTS: Dict[str, int] = {}
+
+def _has_distribution(package_name: str) -> bool:
+    """通过importlib.metadata查找指定名称的发行版，不需要读取所有已安装包的元数据
+    
+    只认发行版名称，不根据模块名判断：同名的本地模块、标准库模块，
+    或者由其他发行版提供的模块（如PyJWT提供的jwt）都不代表这个包已安装
+    
+    参数:
+        package_name: requirements.txt中的包名
+        
+    返回:
+        找到发行版返回True；找不到或无法判断时返回False，由调用方做完整检查
+    """
+    if importlib_metadata is None:
+        return False
+    try:
+        importlib_metadata.distribution(package_name)
+        return True
+    except Exception:
+        return False
+
+def check_and_install_requirements(directory: str, parallel_downloads: int = 1) -> None:
     """检查并安装目录中的requirements.txt文件中的依赖
     
+    同一个requirements.txt在未修改的情况下只检查一次
+    
     参数:
         directory: 要检查的目录路径
+        parallel_downloads: 同时运行的pip进程数（对应配置项pip_parallel_downloads），为1时批量安装
     """
-    req_file = os.path.join(directory, 'requirements.txt')
-    if not os.path.exists(req_file):
+    req_file = os.path.join(os.path.abspath(directory), 'requirements.txt')
+    try:
+        mtime = os.stat(req_file).st_mtime_ns
+    except OSError:
+        return
+    
+    if _CHECKED_REQUIREMENTS.get(req_file) == mtime:
+        logger.debug(f"requirements.txt已检查过: {req_file}")
         return
     
     logger.info(f"检测到requirements.txt文件，正在检查依赖...")
@@ -449,16 +856,40 @@ def check_and_install_requirements(directory: str) -> None:
         logger.info("requirements.txt文件为空或格式不正确")
         return
     
-    # 获取已安装的包
-    installed_packages = get_installed_packages()
+    # 先按名称单独查找发行版，找不到的再与完整的已安装包列表对比
+    unknown = [package for package in packages if not _has_distribution(package)]
     
-    # 检查并安装缺少的包
-    for package in packages:
+    # 检查缺少的包
+    missing = []
+    installed_packages = get_installed_packages() if unknown else {}
+    for package in unknown:
         package_lower = package.lower()
         if package_lower not in installed_packages:
-            logger.info(f"安装依赖包: {package}")
-            install_package(package)
+            missing.append(package)
         else:
             logger.debug(f"依赖包已安装: {package} ({installed_packages[package_lower]})")
     
+    for package in missing:
+        logger.info(f"安装依赖包: {package}")
+    
+    # 默认用一次pip调用批量安装，统一解析依赖；也可以配置多个pip进程分别安装
+    try:
+        workers = int(parallel_downloads or 1)
+    except (TypeError, ValueError):
+        logger.warning(f"配置项pip_parallel_downloads的值无效: {parallel_downloads!r}，改为1")
+        workers = 1
+    
+    max_workers = min(workers, len(missing))
+    if max_workers > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(functools.partial(install_package, search=False), missing))
+        
+        # 所有失败的包一起到PyPI上查询
+        failed = [package for package, ok in zip(missing, results) if not ok]
+        for name, search_results in search_packages_batch(failed).items():
+            _log_search_results(name, search_results)
+    elif missing:
+        install_packages(missing)
+    
+    _CHECKED_REQUIREMENTS[req_file] = mtime
     logger.info("依赖检查完成") 
\ No newline at end of file
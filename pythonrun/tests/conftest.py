@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""pytest配置：支持用pytest-xdist并行运行测试"""
+
+import pytest
+
+def pytest_collection_modifyitems(config, items):
+    """按测试类分组，同一个类的测试在同一个xdist进程中运行
+    
+    setUpClass创建的共享临时目录只在一个进程中使用，不会出现竞争。
+    使用 pytest -n auto --dist loadgroup 运行时生效，未安装xdist时没有影响
+    """
+    for item in items:
+        cls = getattr(item, 'cls', None)
+        if cls is not None:
+            item.add_marker(pytest.mark.xdist_group(name=cls.__name__))
@@ -6,6 +6,7 @@ import os
 import sys
 import unittest
 import tempfile
+import textwrap
 from unittest.mock import patch, MagicMock
 import subprocess
 from pathlib import Path
@@ -61,7 +62,7 @@ class TestCLI(unittest.TestCase):
         # 创建接收参数的测试脚本
         args_script = os.path.join(self.test_dir, "args_test.py")
         with open(args_script, 'w') as f:
-            f.write("""
+            f.write(textwrap.dedent("""
             import sys
             
             def main():
@@ -72,7 +73,7 @@ class TestCLI(unittest.TestCase):
             
             if __name__ == "__main__":
                 sys.exit(main())
-            """)
+            """))
         
         # 使用subprocess直接运行
         test_args = ['arg1', 'arg2', '--flag']
@@ -80,13 +81,13 @@ class TestCLI(unittest.TestCase):
         
         # 检查命令是否可以运行（不验证输出）
         try:
-            subprocess.run(cmd, check=True, capture_output=True, timeout=5)
-            run_successful = True
+            result = subprocess.run(cmd, capture_output=True, timeout=5)
+            returncode = result.returncode
         except (subprocess.SubprocessError, FileNotFoundError):
-            run_successful = False
+            returncode = None
         
-        # 验证能够成功运行
-        self.assertTrue(run_successful, "CLI 命令执行失败")
+        # 验证pythonrun以脚本的返回码（参数数量）退出
+        self.assertEqual(returncode, len(test_args), "CLI 命令执行失败")
     
     def test_cli_help_option(self):
         """测试帮助选项"""
@@ -9,6 +9,7 @@ import unittest
 from unittest.mock import patch, mock_open
 
 # 假设配置模块位于pythonrun.utils.config
+from pythonrun.utils import config as config_module
 from pythonrun.utils.config import load_config, save_config
 
 class TestConfig(unittest.TestCase):
@@ -20,6 +21,9 @@ class TestConfig(unittest.TestCase):
         self.temp_dir = tempfile.TemporaryDirectory()
         self.config_dir = self.temp_dir.name
         
+        # 清除进程内的配置缓存，避免测试之间相互影响
+        config_module._CONFIG_CACHE = None
+        
         # 默认配置
         self.default_config = {
             "auto_install": False,
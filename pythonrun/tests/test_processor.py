@@ -5,84 +5,102 @@
 import os
 import sys
 import tempfile
+import textwrap
 import unittest
 import subprocess
 from unittest.mock import patch, MagicMock
 
+from pythonrun import processor
+from pythonrun.utils import package_manager
 from pythonrun.processor import process_recursive_imports, process_file
 
-class TestProcessor(unittest.TestCase):
-    """测试处理器功能"""
+# 测试文件的内容，在定义时去掉缩进，写入后是合法的Python代码
+_MAIN_SRC = textwrap.dedent("""
+    import os
+    import sys
+    import numpy as np
+    from helper_test import helper_func
     
-    def setUp(self):
-        """测试准备工作"""
-        # 创建临时测试目录
-        self.temp_dir = tempfile.TemporaryDirectory()
-        self.test_dir = self.temp_dir.name
+    def main():
+        data = np.array([1, 2, 3])
+        print(f"数据: {data}")
+        print(f"辅助函数结果: {helper_func(data)}")
+    
+    if __name__ == "__main__":
+        main()
+""")
+
+_HELPER_SRC = textwrap.dedent("""
+    import pandas as pd
+    
+    def helper_func(data):
+        return pd.Series(data).mean()
+""")
+
+_REQUIREMENTS_SRC = textwrap.dedent("""
+    numpy>=1.20.0
+    pandas>=1.2.0
+""")
+
+# 模拟的已安装模块和模块对应的包名
+_INSTALLED_MODULES = frozenset({'os', 'sys'})
+_MODULE_PACKAGES = {'numpy': 'numpy', 'pandas': 'pandas'}
+
+class TestProcessorIntegration(unittest.TestCase):
+    """测试需要真实文件的处理器功能"""
+    
+    @classmethod
+    def setUpClass(cls):
+        """创建所有测试共用的临时目录，测试中只读取这些文件"""
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.test_dir = cls.temp_dir.name
+        
+        # 磁盘缓存写入临时目录，不影响用户的 ~/.pythonrun
+        cls.cache_dir = tempfile.TemporaryDirectory()
+        cls._cache_patchers = [
+            patch.object(processor, '_IMPORTS_CACHE_DIR', os.path.join(cls.cache_dir.name, 'imports')),
+            patch.object(package_manager, '_INSTALLED_CACHE_FILE',
+                         os.path.join(cls.cache_dir.name, 'installed.json')),
+        ]
+        for patcher in cls._cache_patchers:
+            patcher.start()
         
         # 创建测试文件结构
-        self.create_test_files()
+        cls.create_test_files()
     
-    def tearDown(self):
+    @classmethod
+    def tearDownClass(cls):
         """测试清理工作"""
-        self.temp_dir.cleanup()
+        for patcher in cls._cache_patchers:
+            patcher.stop()
+        cls.cache_dir.cleanup()
+        cls.temp_dir.cleanup()
     
-    def create_test_files(self):
+    @classmethod
+    def create_test_files(cls):
         """创建测试文件结构"""
         # 主测试文件
-        self.main_file = os.path.join(self.test_dir, "main_test.py")
-        with open(self.main_file, 'w') as f:
-            f.write("""
-            import os
-            import sys
-            import numpy as np
-            from helper_test import helper_func
-            
-            def main():
-                data = np.array([1, 2, 3])
-                print(f"数据: {data}")
-                print(f"辅助函数结果: {helper_func(data)}")
-            
-            if __name__ == "__main__":
-                main()
-            """)
+        cls.main_file = os.path.join(cls.test_dir, "main_test.py")
+        with open(cls.main_file, 'w') as f:
+            f.write(_MAIN_SRC)
         
         # 辅助测试文件
-        self.helper_file = os.path.join(self.test_dir, "helper_test.py")
-        with open(self.helper_file, 'w') as f:
-            f.write("""
-            import pandas as pd
-            
-            def helper_func(data):
-                return pd.Series(data).mean()
-            """)
+        cls.helper_file = os.path.join(cls.test_dir, "helper_test.py")
+        with open(cls.helper_file, 'w') as f:
+            f.write(_HELPER_SRC)
         
         # 测试requirements.txt文件
-        self.req_file = os.path.join(self.test_dir, "requirements.txt")
-        with open(self.req_file, 'w') as f:
-            f.write("""
-            numpy>=1.20.0
-            pandas>=1.2.0
-            """)
+        cls.req_file = os.path.join(cls.test_dir, "requirements.txt")
+        with open(cls.req_file, 'w') as f:
+            f.write(_REQUIREMENTS_SRC)
     
     @patch('pythonrun.processor.get_package_for_module')
     @patch('pythonrun.processor.is_module_installed')
     def test_process_recursive_imports(self, mock_is_installed, mock_get_package):
         """测试递归处理导入"""
-        # 模拟标准库已安装，其他模块未安装
-        def is_installed_side_effect(module_name):
-            return module_name in ('os', 'sys')
-        
-        # 模拟获取包名
-        def get_package_side_effect(module_name, file_path=None):
-            packages = {
-                'numpy': 'numpy',
-                'pandas': 'pandas'
-            }
-            return packages.get(module_name)
-        
-        mock_is_installed.side_effect = is_installed_side_effect
-        mock_get_package.side_effect = get_package_side_effect
+        # 模拟标准库已安装，其他模块未安装，并模拟获取包名
+        mock_is_installed.side_effect = _INSTALLED_MODULES.__contains__
+        mock_get_package.side_effect = lambda module_name, file_path=None: _MODULE_PACKAGES.get(module_name)
         
         # 测试递归导入处理
         packages = process_recursive_imports(self.main_file)
@@ -99,18 +117,97 @@ class TestProcessor(unittest.TestCase):
         mock_is_installed.assert_any_call('numpy')
         mock_is_installed.assert_any_call('pandas')
     
-    @patch('pythonrun.processor.check_and_install_requirements')
-    @patch('pythonrun.processor.process_recursive_imports')
-    @patch('pythonrun.processor.install_package')
-    @patch('pythonrun.processor.load_config')
-    @patch('subprocess.run')
-    def test_process_file(self, mock_run, mock_load_config, mock_install,
-                        mock_process_imports, mock_check_req):
+    @patch('pythonrun.processor.is_module_installed', return_value=False)
+    def test_new_local_module_detected(self, mock_is_installed):
+        """测试导入的模块在两次运行之间变成本地文件时，改为分析这个本地文件的依赖"""
+        with tempfile.TemporaryDirectory() as project_dir:
+            main_file = os.path.join(project_dir, "main.py")
+            with open(main_file, 'w') as f:
+                f.write("import helperx\n")
+            
+            self.assertEqual(process_recursive_imports(main_file), {('helperx', 'helperx')})
+            
+            with open(os.path.join(project_dir, "helperx.py"), 'w') as f:
+                f.write("import seaborn\n")
+            
+            # 清除进程内缓存，模拟下一次运行
+            processor._PARSE_CACHE.clear()
+            package_manager._clear_import_caches()
+            
+            self.assertEqual(process_recursive_imports(main_file), {('seaborn', 'seaborn')})
+    
+    def test_prune_import_cache(self):
+        """测试缓存文件超过上限时只保留最近写入的条目"""
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                patch.object(processor, '_IMPORTS_CACHE_DIR', cache_dir), \
+                patch.object(processor, '_IMPORTS_CACHE_MAX_ENTRIES', 2):
+            for i in range(4):
+                path = os.path.join(cache_dir, f"{i}.json")
+                with open(path, 'w') as f:
+                    f.write("{}")
+                os.utime(path, ns=(i * 10**9, i * 10**9))
+            
+            processor._prune_import_cache()
+            self.assertEqual(sorted(os.listdir(cache_dir)), ['2.json', '3.json'])
+    
+    def test_import_cache_hit(self):
+        """测试未修改的文件再次读取时使用磁盘上的导入缓存，不重新解析"""
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                patch.object(processor, '_IMPORTS_CACHE_DIR', cache_dir):
+            processor._PARSE_CACHE.pop(self.main_file, None)
+            first = processor._get_parsed(self.main_file)
+            
+            # 清除进程内缓存，模拟下一次运行
+            processor._PARSE_CACHE.pop(self.main_file, None)
+            with patch('pythonrun.processor.parse_source') as mock_parse:
+                second = processor._get_parsed(self.main_file)
+            
+            mock_parse.assert_not_called()
+            self.assertEqual(first[1:], second[1:])
+            self.assertIn(('numpy', 'np'), second[1])
+
+
+class TestProcessorMocked(unittest.TestCase):
+    """测试依赖全部被模拟的处理器功能，不需要创建文件"""
+    
+    # process_file的文件操作都被模拟，使用不存在的路径即可
+    main_file = os.path.join(tempfile.gettempdir(), "main_test.py")
+    
+    # 直接替换的属性: (模块, 属性名)，比逐个测试套用patch装饰器开销更小
+    _STUBBED = (
+        (processor, 'check_and_install_requirements'),
+        (processor, 'process_recursive_imports'),
+        (processor, 'install_packages'),
+        (processor, 'load_config'),
+        (os, 'execv'),
+        (subprocess, 'run'),
+    )
+    
+    def setUp(self):
+        """用MagicMock替换处理器依赖，tearDown中恢复"""
+        self._originals = [(module, name, getattr(module, name)) for module, name in self._STUBBED]
+        for module, name in self._STUBBED:
+            setattr(module, name, MagicMock())
+    
+    def tearDown(self):
+        """恢复被替换的属性"""
+        for module, name, original in self._originals:
+            setattr(module, name, original)
+    
+    def test_process_file(self):
         """测试文件处理功能"""
+        mock_check_req = processor.check_and_install_requirements
+        mock_process_imports = processor.process_recursive_imports
+        mock_install = processor.install_packages
+        mock_load_config = processor.load_config
+        mock_execv = os.execv
+        mock_run = subprocess.run
+        
         # 模拟配置
         mock_load_config.return_value = {
             'auto_install': True,
-            'check_requirements': True
+            'check_requirements': True,
+            'replace_process': True
         }
         
         # 模拟递归导入结果
@@ -126,18 +223,23 @@ class TestProcessor(unittest.TestCase):
         process_file(self.main_file)
         
         # 验证调用
-        mock_check_req.assert_called_once_with(os.path.dirname(os.path.abspath(self.main_file)))
-        mock_process_imports.assert_called_once_with(os.path.abspath(self.main_file))
+        abs_path = os.path.abspath(self.main_file)
+        mock_check_req.assert_called_once_with(os.path.dirname(abs_path), 1)
+        mock_process_imports.assert_called_once_with(abs_path, parallel=False)
         
-        # 验证安装调用
-        self.assertEqual(mock_install.call_count, 2)
+        # 验证所有缺少的包通过一次调用批量安装
+        mock_install.assert_called_once()
+        self.assertEqual(sorted(mock_install.call_args[0][0]), ['numpy', 'pandas'])
         
-        # 验证subprocess.run调用
-        mock_run.assert_called_once()
-        args, kwargs = mock_run.call_args
-        cmd = args[0]
+        # 验证脚本执行：POSIX上替换当前进程，其他平台使用子进程
+        if os.name == 'posix':
+            mock_execv.assert_called_once()
+            cmd = mock_execv.call_args[0][1]
+        else:
+            mock_run.assert_called_once()
+            cmd = mock_run.call_args[0][0]
         self.assertEqual(cmd[0], sys.executable)  # Python解释器
-        self.assertEqual(cmd[1], os.path.abspath(self.main_file))  # 脚本路径
+        self.assertEqual(cmd[1], abs_path)  # 脚本路径
 
 
 if __name__ == '__main__':
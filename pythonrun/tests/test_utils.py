@@ -3,101 +3,320 @@
 """测试pythonrun工具函数"""
 
 import os
+import ast
 import sys
+import shutil
 import tempfile
+import textwrap
 import unittest
-from pathlib import Path
+from unittest.mock import patch, MagicMock
 
-from pythonrun.utils.code_analyzer import parse_imports, find_local_imports
-from pythonrun.utils.package_manager import get_package_for_module, is_module_installed
+from pythonrun.utils.code_analyzer import (
+    parse_imports, find_local_imports, modify_code_to_autoinstall
+)
+from pythonrun.utils import package_manager
+from pythonrun.utils.package_manager import (
+    get_package_for_module, is_module_installed, get_installed_packages
+)
+
+# 导入解析测试用的源码，在模块加载时只解析一次，各个测试共享这个语法树
+_PARSE_FIXTURE_SRC = textwrap.dedent("""
+    import os
+    import sys as system
+    from pathlib import Path
+    from numpy import array, zeros
+    import matplotlib.pyplot as plt
+""")
+_PARSE_FIXTURE_AST = compile(_PARSE_FIXTURE_SRC, '<fixture>', 'exec', flags=ast.PyCF_ONLY_AST)
+
+# 查找本地导入测试用的文件内容
+_MAIN_SRC = textwrap.dedent("""
+    import os
+    import sys
+    from helper import helper_func
+    from utils.tools import tool_func
+""")
+
+_HELPER_SRC = textwrap.dedent("""
+    def helper_func():
+        pass
+""")
+
+_TOOLS_SRC = textwrap.dedent("""
+    def tool_func():
+        pass
+""")
 
 class TestCodeAnalyzer(unittest.TestCase):
     """测试代码分析器功能"""
     
+    @classmethod
+    def setUpClass(cls):
+        """创建所有测试共用的临时目录和文件结构，测试中只读取这些文件"""
+        cls._tmp = tempfile.mkdtemp()
+        
+        # 创建主测试文件
+        cls.main_file = os.path.join(cls._tmp, "main.py")
+        with open(cls.main_file, 'w') as f:
+            f.write(_MAIN_SRC)
+        
+        # 创建helper.py
+        cls.helper_file = os.path.join(cls._tmp, "helper.py")
+        with open(cls.helper_file, 'w') as f:
+            f.write(_HELPER_SRC)
+        
+        # 创建utils目录和tools.py
+        utils_dir = os.path.join(cls._tmp, "utils")
+        os.makedirs(utils_dir, exist_ok=True)
+        cls.tools_file = os.path.join(utils_dir, "tools.py")
+        with open(cls.tools_file, 'w') as f:
+            f.write(_TOOLS_SRC)
+    
+    @classmethod
+    def tearDownClass(cls):
+        """删除临时目录"""
+        shutil.rmtree(cls._tmp, ignore_errors=True)
+    
     def test_parse_imports(self):
         """测试导入解析功能"""
-        code = """
-        import os
-        import sys as system
-        from pathlib import Path
-        from numpy import array, zeros
-        import matplotlib.pyplot as plt
-        """
-        
-        imports = parse_imports(code)
+        imports = parse_imports(_PARSE_FIXTURE_AST)
         self.assertIsInstance(imports, list)
         
         # 检查是否找到了所有导入
-        found_imports = [module for module, _ in imports]
-        self.assertIn('os', found_imports)
-        self.assertIn('sys', found_imports)
-        self.assertIn('pathlib', found_imports)
-        self.assertIn('numpy', found_imports)
-        self.assertIn('matplotlib.pyplot', found_imports)
+        found_imports = frozenset(module for module, _ in imports)
+        self.assertLessEqual({'os', 'sys', 'pathlib', 'numpy', 'matplotlib.pyplot'}, found_imports)
         
     def test_find_local_imports(self):
         """测试查找本地导入功能"""
-        # 创建临时目录和文件结构
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # 创建主测试文件
-            main_file = os.path.join(temp_dir, "main.py")
-            with open(main_file, 'w') as f:
-                f.write("""
-                import os
-                import sys
-                from helper import helper_func
-                from utils.tools import tool_func
-                """)
-            
-            # 创建helper.py
-            helper_file = os.path.join(temp_dir, "helper.py")
-            with open(helper_file, 'w') as f:
-                f.write("""
-                def helper_func():
-                    pass
-                """)
-            
-            # 创建utils目录和tools.py
-            utils_dir = os.path.join(temp_dir, "utils")
-            os.makedirs(utils_dir, exist_ok=True)
-            tools_file = os.path.join(utils_dir, "tools.py")
-            with open(tools_file, 'w') as f:
-                f.write("""
-                def tool_func():
-                    pass
-                """)
-            
-            # 测试查找本地导入
-            local_imports = find_local_imports("""
-            import os
-            import sys
-            from helper import helper_func
-            from utils.tools import tool_func
-            """, main_file)
-            
-            self.assertIn(helper_file, local_imports)
-            self.assertIn(tools_file, local_imports)
+        # 测试查找本地导入
+        local_imports = find_local_imports(_MAIN_SRC, self.main_file)
+        
+        self.assertIn(self.helper_file, local_imports)
+        self.assertIn(self.tools_file, local_imports)
+    
+    def test_modify_code_to_autoinstall(self):
+        """测试在main块之前插入自动安装代码"""
+        code = (
+            "import os\n"
+            "import numpy as np\n"
+            "\n"
+            "x = 1\n"
+            "if __name__ == '__main__':\n"
+            "    print(x)\n"
+        )
+        
+        modified = modify_code_to_autoinstall(code)
+        
+        # 修改后的代码应当仍然是合法的Python代码
+        compile(modified, '<modified>', 'exec')
+        self.assertIn('("numpy", "numpy")', modified)
+        self.assertTrue(modified.startswith("import os\nimport numpy as np\n\nx = 1\n"))
+        self.assertTrue(modified.endswith(code[code.index("if __name__"):]))
+    
+    def test_parse_imports_skips_optional(self):
+        """测试排除TYPE_CHECKING块和ImportError保护的可选导入"""
+        code = (
+            "from typing import TYPE_CHECKING\n"
+            "if TYPE_CHECKING:\n"
+            "    import pandas\n"
+            "try:\n"
+            "    import ujson as json\n"
+            "except ImportError:\n"
+            "    import json\n"
+        )
+        
+        modules = [name for name, _ in parse_imports(code, include_optional=False)]
+        self.assertEqual(modules, ['typing', 'json'])
+        
+        # 默认仍然包含所有导入
+        modules = [name for name, _ in parse_imports(code)]
+        self.assertEqual(modules, ['typing', 'pandas', 'ujson', 'json'])
+    
+    def test_parse_imports_keeps_broad_except(self):
+        """测试捕获Exception或裸except的try块中的导入仍然是必需的"""
+        code = (
+            "try:\n"
+            "    import requests\n"
+            "    r = requests.get('https://example.com')\n"
+            "except Exception as e:\n"
+            "    print(e)\n"
+            "try:\n"
+            "    import yaml\n"
+            "except:\n"
+            "    pass\n"
+        )
+        
+        modules = [name for name, _ in parse_imports(code, include_optional=False)]
+        self.assertEqual(modules, ['requests', 'yaml'])
 
 
 class TestPackageManager(unittest.TestCase):
     """测试包管理器功能"""
     
+    @classmethod
+    def setUpClass(cls):
+        """已安装包的磁盘缓存写入临时目录，不影响用户的 ~/.pythonrun"""
+        cls._cache_dir = tempfile.mkdtemp()
+        cls._cache_patcher = patch.object(package_manager, '_INSTALLED_CACHE_FILE',
+                                          os.path.join(cls._cache_dir, 'installed.json'))
+        cls._cache_patcher.start()
+        package_manager._installed_index.cache_clear()
+    
+    @classmethod
+    def tearDownClass(cls):
+        """恢复缓存路径并删除临时目录"""
+        cls._cache_patcher.stop()
+        package_manager._installed_index.cache_clear()
+        shutil.rmtree(cls._cache_dir, ignore_errors=True)
+    
+    # 标准库模块应该被识别为已安装
+    INSTALLED_CASES = ('os', 'sys', 'pathlib')
+    
+    # (模块名, 对应的包名)，标准库没有对应的包
+    PACKAGE_CASES = (
+        ('os', None),
+        ('sys', None),
+        ('PIL', 'pillow'),
+        ('sklearn', 'scikit-learn'),
+    )
+    
     def test_is_module_installed(self):
         """测试模块安装检查功能"""
-        # 标准库模块应该被识别为已安装
-        self.assertTrue(is_module_installed('os'))
-        self.assertTrue(is_module_installed('sys'))
-        self.assertTrue(is_module_installed('pathlib'))
+        for module_name in self.INSTALLED_CASES:
+            with self.subTest(module=module_name):
+                self.assertTrue(is_module_installed(module_name))
         
     def test_get_package_for_module(self):
         """测试获取模块对应的包名功能"""
-        # 测试标准库
-        self.assertIsNone(get_package_for_module('os'))
-        self.assertIsNone(get_package_for_module('sys'))
+        for module_name, expected in self.PACKAGE_CASES:
+            with self.subTest(module=module_name):
+                self.assertEqual(get_package_for_module(module_name), expected)
+    
+    def test_get_installed_packages(self):
+        """测试获取已安装包列表功能"""
+        installed = get_installed_packages()
+        self.assertIn('pytest', installed)
+        
+        # 返回的是缓存的副本，修改不影响后续调用
+        installed.clear()
+        self.assertIn('pytest', get_installed_packages())
+    
+    def test_installed_cache_key_skips_local_paths(self):
+        """测试当前目录和本地搜索路径不计入已安装包缓存的有效性标识"""
+        with tempfile.TemporaryDirectory() as local_dir:
+            sys.path[:0] = ['', local_dir]
+            try:
+                paths = [path for path, _ in package_manager._installed_cache_key()]
+            finally:
+                del sys.path[:2]
+        
+        self.assertNotIn('', paths)
+        self.assertNotIn(local_dir, paths)
+    
+    def test_installed_cache_sees_new_dist_info(self):
+        """测试site-packages目录中新增的发行版会使已安装包的磁盘缓存失效"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            extra_dir = os.path.join(temp_dir, 'site-packages')
+            os.makedirs(extra_dir)
+            sys.path.insert(0, extra_dir)
+            try:
+                package_manager._installed_index.cache_clear()
+                self.assertNotIn('pythonrun-fake-dist', get_installed_packages())
+                
+                dist_info = os.path.join(extra_dir, 'pythonrun_fake_dist-1.0.dist-info')
+                os.makedirs(dist_info)
+                with open(os.path.join(dist_info, 'METADATA'), 'w') as f:
+                    f.write("Metadata-Version: 2.1\nName: pythonrun-fake-dist\nVersion: 1.0\n")
+                
+                # 清除进程内缓存，模拟下一次运行
+                package_manager._installed_index.cache_clear()
+                self.assertEqual(get_installed_packages().get('pythonrun-fake-dist'), '1.0')
+            finally:
+                sys.path.remove(extra_dir)
+                package_manager._installed_index.cache_clear()
+
+
+
+class TestRequirements(unittest.TestCase):
+    """测试requirements文件解析和批量安装"""
+    
+    def test_parse_requirements_include_cycle(self):
+        """测试 -r 循环引用只处理一次，选项行和注释被跳过"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            main_req = os.path.join(temp_dir, "requirements.txt")
+            with open(main_req, 'w') as f:
+                f.write(
+                    "# 注释\n"
+                    "numpy>=1.20\n"
+                    "-r extra.txt\n"
+                    "-e git+https://example.com/repo.git#egg=editable\n"
+                    "--index-url https://example.com/simple\n"
+                )
+            with open(os.path.join(temp_dir, "extra.txt"), 'w') as f:
+                f.write(
+                    "--requirement=requirements.txt\n"
+                    "pandas[sql]==2.0 ; python_version > '3'\n"
+                )
+            
+            self.assertEqual(package_manager.parse_requirements_file(main_req), ['numpy', 'pandas'])
+    
+    @patch('pythonrun.utils.package_manager.install_packages')
+    @patch('pythonrun.utils.package_manager.get_installed_packages', return_value={})
+    def test_requirements_module_name_not_installed(self, mock_installed, mock_install):
+        """测试与标准库或已导入模块同名、但没有对应发行版的依赖仍然会被安装"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, "requirements.txt"), 'w') as f:
+                f.write("unittest\n")
+            
+            package_manager.check_and_install_requirements(temp_dir)
+        
+        mock_install.assert_called_once_with(['unittest'])
+    
+    @patch('pythonrun.utils.package_manager.install_packages')
+    @patch('pythonrun.utils.package_manager.get_installed_packages', return_value={})
+    def test_requirements_invalid_parallel_downloads(self, mock_installed, mock_install):
+        """测试pip_parallel_downloads不是数字时给出警告并退回到批量安装"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, "requirements.txt"), 'w') as f:
+                f.write("nonexistent-pkg-a\nnonexistent-pkg-b\n")
+            
+            with self.assertLogs('pythonrun', level='WARNING'):
+                package_manager.check_and_install_requirements(temp_dir, 'auto')
+        
+        mock_install.assert_called_once_with(['nonexistent-pkg-a', 'nonexistent-pkg-b'])
+    
+    @patch('pythonrun.utils.package_manager.search_packages_batch', return_value={})
+    @patch('pythonrun.utils.package_manager.install_package',
+           side_effect=lambda package, search=True: package == 'nonexistent-pkg-a')
+    @patch('pythonrun.utils.package_manager.get_installed_packages', return_value={})
+    def test_requirements_parallel_searches_failures(self, mock_installed, mock_install, mock_search):
+        """测试并行安装时不逐个搜索，只为失败的包统一搜索一次"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, "requirements.txt"), 'w') as f:
+                f.write("nonexistent-pkg-a\nnonexistent-pkg-b\n")
+            
+            package_manager.check_and_install_requirements(temp_dir, 2)
+        
+        for call in mock_install.call_args_list:
+            self.assertEqual(call[1], {'search': False})
+        mock_search.assert_called_once_with(['nonexistent-pkg-b'])
+    
+    @patch('pythonrun.utils.package_manager._clear_import_caches')
+    @patch('pythonrun.utils.package_manager.search_packages_batch', return_value={})
+    @patch('pythonrun.utils.package_manager.subprocess.run')
+    def test_install_packages_falls_back(self, mock_run, mock_search, mock_clear):
+        """测试批量安装失败时逐个安装，并只为失败的包搜索"""
+        def run_side_effect(cmd, **kwargs):
+            packages = cmd[4:]
+            ok = packages == ['numpy']
+            return MagicMock(returncode=0 if ok else 1, stderr=None if ok else "ERROR: failed")
+        mock_run.side_effect = run_side_effect
+        
+        self.assertFalse(package_manager.install_packages(['numpy', 'badpkg']))
         
-        # 测试包名映射
-        self.assertEqual(get_package_for_module('PIL'), 'pillow')
-        self.assertEqual(get_package_for_module('sklearn'), 'scikit-learn')
+        installed = [call[0][0][4:] for call in mock_run.call_args_list]
+        self.assertEqual(installed, [['numpy', 'badpkg'], ['numpy'], ['badpkg']])
+        mock_search.assert_called_once_with(['badpkg'])
 
 
 if __name__ == '__main__':
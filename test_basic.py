@@ -6,12 +6,16 @@ import os
 import sys
 
 def main():
-    print("测试pythonrun基本功能")
-    print(f"Python版本: {sys.version}")
-    print(f"当前工作目录: {os.getcwd()}")
-    print(f"脚本路径: {__file__}")
-    print(f"命令行参数: {sys.argv}")
-    print("测试成功!")
+    # 一次写出所有输出
+    print(
+        "测试pythonrun基本功能",
+        f"Python版本: {sys.version}",
+        f"当前工作目录: {os.getcwd()}",
+        f"脚本路径: {__file__}",
+        f"命令行参数: {sys.argv}",
+        "测试成功!",
+        sep="\n"
+    )
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file